@@ -1,22 +1,111 @@
-from openai import OpenAI
-from io import BytesIO
-import base64
-from PIL import Image
+from clients import get_client, API_BASE, API_KEY, LOCAL_API_BASE, LOCAL_API_KEY
+from image_cache import encode_image, image_digest
+from response_cache import get_response_cache
+from ratelimit import get_limiter, estimate_tokens, is_connection_error
+from tracing import get_tracer
+from compaction import compact_text
+import json
+import math
+import re
+import time
+
+REFUSAL_MARKERS = ("i won", "m not", "i can't", "i can’t", "i cannot", "i do not", "stop", "refuse", "unable", "sorry")
+
+class RefusalRetryPolicy:
+    # Decides whether a reply is a refusal and which temperature each retry uses.
+    # `temperatures[k]` is used for retry k+1 (the last entry repeats); the first attempt keeps the caller's temperature.
+    def __init__(self, max_attempts=2, temperatures=(), markers=REFUSAL_MARKERS, max_refusal_length=200):
+        self.max_attempts = max(1, max_attempts)
+        self.temperatures = list(temperatures)
+        self.max_refusal_length = max_refusal_length
+        self.matcher = re.compile('|'.join(re.escape(m) for m in markers), re.IGNORECASE)
+
+    def is_refusal(self, text):
+        if len(text) >= self.max_refusal_length:
+            return False
+        return len(text) == 0 or self.matcher.search(text) is not None
+
+    def temperature(self, attempt, base):
+        if attempt == 0 or not self.temperatures:
+            return base
+        return self.temperatures[min(attempt - 1, len(self.temperatures) - 1)]
+
+DEFAULT_RETRY_POLICY = RefusalRetryPolicy()
+
+HISTORY_POLICIES = ('full', 'compact')
+
+# A complete answer field: the letter must be followed by another character, so a streamed
+# "#Answer: A" is not taken for an answer before it is known not to be the start of a word.
+ANSWER_FIELD = re.compile(r'#\s*(?:Final\s+)?Answer\s*:\s*\(?\s*[A-Za-z](?=[^A-Za-z])')
+# The answer letter of a finished reply, which may end right after it.
+ANSWER_LETTER = re.compile(r'#\s*(?:Final\s+)?Answer\s*:\s*\(?\s*([A-Za-z])(?![A-Za-z])')
+
+def answer_confidence(text, tokens):
+    # Probability the model gave its answer letter, from the logprob of the token carrying it.
+    # tokens: [(token_text, logprob), ...] covering `text`; None when the reply has no answer field.
+    matches = list(ANSWER_LETTER.finditer(text))
+    if not matches or not tokens:
+        return None
+    position = matches[-1].start(1)
+    offset = 0
+    for token, logprob in tokens:
+        if offset <= position < offset + len(token):
+            return math.exp(logprob)
+        offset += len(token)
+    return None
+
+def logprob_tokens(logprobs):
+    # choice.logprobs from the SDK, or its dict form in batch output files
+    content = getattr(logprobs, 'content', None) if not isinstance(logprobs, dict) else logprobs.get('content')
+    if not content:
+        return []
+    if isinstance(content[0], dict):
+        return [(t['token'], t['logprob']) for t in content]
+    return [(t.token, t.logprob) for t in content]
 
 class Agent:
-    def __init__(self, model_info='YOUR MODEL', local=False):
+    def __init__(self, model_info='YOUR MODEL', local=False, history='full', max_history_turns=None, retry_policy=None, base_url=None, api_key=None, max_tokens=None, stream=False, stop_at_answer=False, logprobs=False, seed=None, reply_tokens=None, pool=None):
+        if history not in HISTORY_POLICIES:
+            raise ValueError(f'Unknown history policy: {history}')
         self.model_info = model_info
-        
-        if not local:
-            self.client = OpenAI(
-                    base_url='YOUR_API', 
-                    api_key='YOUR_KEY'
-                    )
+        # 'compact' sends each image once per conversation and puts images ahead of text, so the
+        # system prompt + image prefix is shared by every agent on a case and stays byte-identical
+        # across turns for server-side prefix caches.
+        self.history = history
+        # with 'compact', keep only the first turn and the last N turns (None keeps all)
+        self.max_history_turns = max_history_turns
+        self.sent_images = set()
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.max_tokens = max_tokens
+        # stream single completions; with stop_at_answer, stop as soon as the answer field is complete. Only for
+        # roles whose reply ends in its own answer field: critics and leaders quote the reports' answer fields.
+        self.stream = stream
+        self.stop_at_answer = stop_at_answer
+        # request token logprobs; `confidences` then holds the answer-letter probability of each answer of the last turn
+        self.logprobs = logprobs
+        self.confidences = []
+        # sampling seed; with DiagnosisConfig.distinct_experts the Level-1 experts get different seeds, which
+        # keeps their requests apart in the response cache and in batch files
+        self.seed = seed
+        # cap in tokens for the agent's own replies kept in its history, so follow-up turns do not resend them in full
+        self.reply_tokens = reply_tokens
+        # endpoints.EndpointPool to route requests over instead of a single endpoint; with a sticky pool the
+        # endpoint of the first request is kept for the conversation
+        self.pool = pool
+        self.endpoint = None
+
+        if pool is not None:
+            self.base_url = None
+            self.client = None
+        elif base_url:
+            self.base_url = base_url
+            self.client = get_client(base_url, api_key or API_KEY)
+        elif not local:
+            self.base_url = API_BASE
+            self.client = get_client(API_BASE, API_KEY)
         else:
-            self.client = OpenAI(
-                base_url='http://localhost:11434/v1', # change to your local url.
-                api_key='111',
-                )
+            self.base_url = LOCAL_API_BASE
+            self.client = get_client(LOCAL_API_BASE, LOCAL_API_KEY)
 
         self.messages = [{
             'role': 'system',
@@ -25,44 +114,40 @@ class Agent:
                 ]
         }]
 
-        # initialize token counter
+        # initialize token counter; totals include every attempt, retry_* is the share spent on refusal retries
         self.token_usage = {
             'prompt_tokens': 0,
             'completion_tokens': 0,
-            'total_tokens': 0
+            'total_tokens': 0,
+            'retry_prompt_tokens': 0,
+            'retry_completion_tokens': 0,
         }
+        # one entry per request sent: attempt index, temperature, tokens, latency and whether it was refused
+        self.attempts = []
          
-    def chat(self, message, image=None, temperature=0.0, retry=2):
+    def _image_parts(self, image):
+        images = image if isinstance(image, list) else [image]
+        parts = []
+        for i in images:
+            if self.history == 'compact':
+                digest = image_digest(i)
+                if digest in self.sent_images:
+                    continue
+                self.sent_images.add(digest)
+            parts.append({'type': 'image_url', 'image_url': {'url': encode_image(i)}})
+        return parts
+
+    def _push_turn(self, message, image=None):
+        content = [{'type': 'text', 'text': message}]
         if image:
-            if isinstance(image, list):
-                content = [{'type': 'text', 'text': message}]
-                for i in image:
-                    buffer = BytesIO()
-                    i.save(buffer, format='JPEG')
-                    i = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                    content.append({'type': 'image_url', 'image_url': {'url': f'data:image/jpeg;base64,{i}'}})
-                message = {
-                        'role': 'user',
-                        'content': content
-                    }
+            if self.history == 'compact':
+                content = self._image_parts(image) + content
             else:
-                buffer = BytesIO()
-                image.save(buffer, format='JPEG')
-                image = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                message = {
-                        'role': 'user',
-                        'content': [
-                            {'type': 'text', 'text': message},
-                            {'type': 'image_url', 'image_url': {'url': f'data:image/jpeg;base64,{image}'}}
-                        ]
-                    }
-        else:
-            message = {
-                    'role': 'user',
-                    'content': [
-                        {'type': 'text', 'text': message},
-                    ]
-                }
+                content = content + self._image_parts(image)
+        message = {
+                'role': 'user',
+                'content': content
+            }
         self.messages.append(message)
         self.messages.append({
                     'role': 'system',
@@ -71,33 +156,260 @@ class Agent:
                     ]
                 })
 
-        check = "refuse"
-        n=0
-        while ("i won" in check.lower() or "m not" in check.lower() or "i can't" in check.lower() or "i can’t" in check.lower() or "i cannot" in check.lower() or "i do not" in check.lower() or "stop" in check.lower() or "refuse" in check.lower() or "unable" in check.lower() or "sorry" in check.lower()) and len(check)<200:
-            response = self.client.chat.completions.create(
-                model=self.model_info,
-                messages=self.messages,
-                temperature=temperature
+    def _add_usage(self, usage, retry=False):
+        if usage:
+            self.token_usage['prompt_tokens'] += usage['prompt_tokens']
+            self.token_usage['completion_tokens'] += usage['completion_tokens']
+            self.token_usage['total_tokens'] += usage['total_tokens']
+            if retry:
+                self.token_usage['retry_prompt_tokens'] += usage['prompt_tokens']
+                self.token_usage['retry_completion_tokens'] += usage['completion_tokens']
+
+    def _attempt(self, temperature, attempt, n=1, retry=None):
+        start = time.time()
+        info = {}
+        contents, usage = self._complete(temperature, attempt, n, info)
+        self._add_usage(usage, retry=attempt > 0 if retry is None else retry)
+        self.attempts.append({
+            'attempt': attempt,
+            'temperature': temperature,
+            'prompt_tokens': usage['prompt_tokens'] if usage else 0,
+            'completion_tokens': usage['completion_tokens'] if usage else 0,
+            'latency': time.time() - start,
+            'queue_wait': info.get('queue_wait', 0.0),
+            'retries': info.get('retries', 0),
+            'backoff': info.get('backoff', 0.0),
+            'cached': info.get('cached', False),
+            'ttft': info.get('ttft'),
+            'confidences': info.get('confidences'),
+            'stopped_early': info.get('stopped_early', False),
+            'endpoint': info.get('endpoint', self.base_url),
+            'refused': False,
+        })
+        return contents
+
+    def _record_span(self, start, first_attempt):
+        tracer = get_tracer()
+        if tracer is None:
+            return
+        attempts = self.attempts[first_attempt:]
+        queue_wait = sum(a['queue_wait'] for a in attempts)
+        backoff = sum(a['backoff'] for a in attempts)
+        tracer.record('chat', start, time.time(),
+                      model=self.model_info,
+                      attempts=len(attempts),
+                      refusals=sum(a['refused'] for a in attempts),
+                      cached=all(a['cached'] for a in attempts) if attempts else False,
+                      prompt_tokens=sum(a['prompt_tokens'] for a in attempts),
+                      completion_tokens=sum(a['completion_tokens'] for a in attempts),
+                      queue_wait=queue_wait,
+                      retries=sum(a['retries'] for a in attempts),
+                      backoff=backoff,
+                      network=sum(a['latency'] for a in attempts) - queue_wait - backoff,
+                      ttft=attempts[0]['ttft'] if attempts else None,
+                      stopped_early=any(a['stopped_early'] for a in attempts),
+                      endpoint=attempts[-1]['endpoint'] if attempts else None)
+
+    def chat(self, message, image=None, temperature=0.0, retry=None):
+        start = time.time()
+        first_attempt = len(self.attempts)
+        self._push_turn(message, image)
+        policy = self.retry_policy
+        max_attempts = retry or policy.max_attempts
+
+        answer = 'None'
+        self.confidences = [None]
+        for attempt in range(max_attempts):
+            contents = self._attempt(policy.temperature(attempt, temperature), attempt)
+            check = contents[0] if contents else ''
+            if not policy.is_refusal(check):
+                answer = check
+                self.confidences = [(self.attempts[-1]['confidences'] or [None])[0]]
+                break
+            self.attempts[-1]['refused'] = True
+
+        self.messages.append({"role": "assistant", "content": compact_text(answer, self.reply_tokens)})
+        self._record_span(start, first_attempt)
+
+        return answer
+
+    def chat_n(self, message, image=None, temperature=0.7, n=2, retry=None):
+        # Draws n independent answers to one prompt. The prompt and image are prefilled once when the
+        # server honours `n`; servers that ignore it (one choice per request) are topped up with extra requests.
+        start = time.time()
+        first_attempt = len(self.attempts)
+        self._push_turn(message, image)
+        policy = self.retry_policy
+        max_refusals = retry or policy.max_attempts
+
+        answers = []
+        confidences = []
+        attempt = 0
+        refusals = 0
+        while len(answers) < n and refusals < max_refusals:
+            # top-ups for servers that ignore `n` are not retries; only requests after a refusal are
+            contents = self._attempt(policy.temperature(refusals, temperature), attempt, n - len(answers), retry=refusals > 0)
+            attempt += 1
+            if not contents:
+                refusals += 1
+            scores = self.attempts[-1]['confidences'] or [None] * len(contents)
+            for content, score in zip(contents, scores):
+                if policy.is_refusal(content):
+                    refusals += 1
+                    self.attempts[-1]['refused'] = True
+                elif len(answers) < n:
+                    answers.append(content)
+                    confidences.append(score)
+        self.confidences = confidences + [None] * (n - len(answers))
+        answers += ['None'] * (n - len(answers))
+
+        self.messages.append({"role": "assistant", "content": compact_text(answers[0], self.reply_tokens)})
+        self._record_span(start, first_attempt)
+
+        return answers
+
+    def _request_messages(self):
+        if self.history != 'compact' or self.max_history_turns is None:
+            return self.messages
+        turn_starts = [k for k, m in enumerate(self.messages) if m['role'] == 'user']
+        if len(turn_starts) <= self.max_history_turns + 1:
+            return self.messages
+        # the first turn carries the image and the shared prefix, so it is never dropped
+        first_turn = self.messages[:turn_starts[1]]
+        recent = self.messages[turn_starts[-self.max_history_turns]:] if self.max_history_turns > 0 else self.messages[turn_starts[-1]:]
+        return first_turn + recent
+
+    def _request_body(self, temperature, n=1):
+        request = {'model': self.model_info, 'messages': self._request_messages(), 'temperature': temperature}
+        if n > 1:
+            request['n'] = n
+        if self.max_tokens:
+            request['max_tokens'] = self.max_tokens
+        if self.logprobs:
+            request['logprobs'] = True
+        if self.seed is not None:
+            request['seed'] = self.seed
+        return request
+
+    def preview_request(self, message, image=None, temperature=0.0, n=1):
+        # The body the next chat()/chat_n() turn would send first, without touching the conversation.
+        messages, sent_images = list(self.messages), set(self.sent_images)
+        try:
+            self._push_turn(message, image)
+            return self._request_body(temperature, n)
+        finally:
+            self.messages, self.sent_images = messages, sent_images
+
+    def _complete(self, temperature, attempt, n=1, info=None):
+        # Returns ([content, ...], usage) for the current conversation, going through the response cache when enabled.
+        request = self._request_body(temperature, n)
+        messages = request['messages']
+        cache = get_response_cache()
+        key = None
+        if cache is not None:
+            key = cache.request_key(request, attempt)
+            cached = cache.get(key)
+            if cached is not None:
+                if info is not None:
+                    info['cached'] = True
+                    info['confidences'] = cached['confidences']
+                if n > 1:
+                    return json.loads(cached['content']), cached['usage']
+                return [cached['content'] or ''], cached['usage']
+
+        if self.stream and n == 1:
+            # the whole stream is consumed inside the limiter, so the in-flight slot and retries cover it
+            contents, usage = self._send(
+                lambda client: self._stream(client, request, info),
+                estimated_tokens=estimate_tokens(messages),
+                token_count=lambda r: r[1]['total_tokens'] if r[1] else None,
+                info=info,
+                )
+        else:
+            response = self._send(
+                lambda client: client.chat.completions.create(**request),
+                estimated_tokens=estimate_tokens(messages),
+                token_count=lambda r: r.usage.total_tokens if getattr(r, 'usage', None) else None,
+                info=info,
                 )
-            check = response.choices[0].message.content
-            
-            n += 1
-            if len(check)==0:
-                check = 'refuse'
-            if n==int(0.4*retry):
-                temperature=1.2
-            if n==retry:
-                check = 'None'
-        re = check
-
-        if hasattr(response, 'usage') and response.usage:
-            self.token_usage['prompt_tokens'] += response.usage.prompt_tokens
-            self.token_usage['completion_tokens'] += response.usage.completion_tokens
-            self.token_usage['total_tokens'] += response.usage.total_tokens
-
-        self.messages.append({"role": "assistant", "content": re})
-
-        return re
+            contents = [choice.message.content or '' for choice in response.choices]
+            if self.logprobs and info is not None:
+                info['confidences'] = [answer_confidence(c, logprob_tokens(getattr(choice, 'logprobs', None))) for c, choice in zip(contents, response.choices)]
+            usage = None
+            if hasattr(response, 'usage') and response.usage:
+                usage = {
+                    'prompt_tokens': response.usage.prompt_tokens,
+                    'completion_tokens': response.usage.completion_tokens,
+                    'total_tokens': response.usage.total_tokens
+                }
+
+        if cache is not None:
+            cache.put(key, self.model_info, json.dumps(contents) if n > 1 else contents[0], usage, info.get('confidences') if info is not None else None)
+        return contents, usage
+
+    def _send(self, send, estimated_tokens=0, token_count=None, info=None):
+        # send(client) performs the request under the endpoint's limiter. With a pool, an endpoint that cannot
+        # be reached is given up on at once while another healthy one is left to try.
+        if self.pool is None:
+            return get_limiter(self.base_url).call(lambda: send(self.client), estimated_tokens=estimated_tokens, token_count=token_count, info=info)
+        tried = []
+        while True:
+            endpoint = self.endpoint
+            if endpoint is None or not endpoint.healthy or endpoint in tried:
+                endpoint = self.pool.choose(exclude=tried)
+            if self.pool.sticky:
+                self.endpoint = endpoint
+            failover = self.pool.has_alternative(endpoint, exclude=tried)
+            if info is not None:
+                info['endpoint'] = endpoint.base_url
+            try:
+                with self.pool.track(endpoint):
+                    return get_limiter(endpoint.base_url).call(lambda: send(endpoint.client), estimated_tokens=estimated_tokens, token_count=token_count, info=info, retry_connection=not failover)
+            except Exception as e:
+                if not failover or not is_connection_error(e):
+                    raise
+                tried.append(endpoint)
+
+    def _stream(self, client, request, info=None):
+        start = time.time()
+        stream = client.chat.completions.create(**request, stream=True, stream_options={'include_usage': True})
+        text = ''
+        tokens = []
+        usage = None
+        stopped = False
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = {
+                        'prompt_tokens': chunk.usage.prompt_tokens,
+                        'completion_tokens': chunk.usage.completion_tokens,
+                        'total_tokens': chunk.usage.total_tokens
+                    }
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if self.logprobs:
+                    tokens.extend(logprob_tokens(getattr(chunk.choices[0], 'logprobs', None)))
+                if info is not None and 'ttft' not in info:
+                    info['ttft'] = time.time() - start
+                text += chunk.choices[0].delta.content
+                match = ANSWER_FIELD.search(text) if self.stop_at_answer else None
+                if match:
+                    # drop whatever the chunk carried past the answer letter
+                    text = text[:match.end()]
+                    stopped = True
+                    break
+        finally:
+            # closing the connection is what stops generation on the server
+            stream.close()
+        if usage is None:
+            # usage only arrives with the last chunk, so a stream cut short is estimated
+            prompt_tokens = estimate_tokens(request['messages'])
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(text) // 4, 'total_tokens': prompt_tokens + len(text) // 4}
+        if info is not None:
+            info['stopped_early'] = stopped
+            if self.logprobs:
+                info['confidences'] = [answer_confidence(text, tokens)]
+        return [text], usage
 
     def get_token_usage(self):
         return self.token_usage
@@ -0,0 +1,142 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from PIL import Image
+from clients import set_client_factory
+from mock_backend import MockClient, make_latency_sampler
+from hierachy_diagnosis import hierachy_diagnosis
+from config import DiagnosisConfig
+from scheduler import bounded_map, configure_fan_out
+from tracing import configure_tracer, get_tracer, trace_context
+import main as ucagents_main
+
+# Measures orchestration overhead and concurrency scaling against mock_backend, without a GPU or network:
+#   python benchmark.py --cases 200 --concurrency 1 8 32 --latency_mean 0.3
+
+class SyntheticCaseSet:
+    def __init__(self, num_cases=100, image_size=512, seed=0):
+        self.num_cases = num_cases
+        self.image_size = image_size
+        self.seed = seed
+        self.dataset = 'synthetic'
+
+    def __len__(self):
+        return self.num_cases
+
+    def iter_cases(self, skip_ids=()):
+        rng = random.Random(self.seed)
+        for case_id in range(self.num_cases):
+            if case_id in skip_ids:
+                continue
+            image = Image.frombytes('RGB', (self.image_size, self.image_size), os.urandom(self.image_size * self.image_size * 3))
+            options = ["(A)yes", "(B)no"]
+            rng.shuffle(options)
+            question = f'Question: Is there evidence of lesion {case_id}?\nOptions:' + ' '.join(options)
+            yield {'question': question, 'image': image, 'case_id': case_id}, rng.choice(['A', 'B'])
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', type=str, default='diagnosis', choices=['diagnosis', 'main'], help='drive hierachy_diagnosis directly, or main() end to end')
+    parser.add_argument('--cases', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--latency_dist', type=str, default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--latency_mean', type=float, default=0.2, help='mean mock latency per call in seconds')
+    parser.add_argument('--latency_spread', type=float, default=0.5)
+    parser.add_argument('--refusal_rate', type=float, default=0.0)
+    parser.add_argument('--error_rate', type=float, default=0.0)
+    parser.add_argument('--level1_sampling', action='store_true')
+    parser.add_argument('--stream', action='store_true', help='stream completions and stop at the answer field')
+    parser.add_argument('--level1_confidence', type=float, default=0, help='Level-1 early-exit threshold, 0 disables')
+    parser.add_argument('--report_tokens', type=int, default=0, help='token cap per report section carried into Level-3, 0 disables')
+    parser.add_argument('--report_summarizer', action='store_true', help='condense over-cap reports with a summarizer call')
+    parser.add_argument('--token_latency', type=float, default=0.0, help='mock delay per streamed chunk in seconds')
+    parser.add_argument('--trailing_chars', type=int, default=0, help='mock text generated after the answer field')
+    parser.add_argument('--output', type=str, default='', help='write results as JSON here')
+    return parser.parse_args()
+
+def run_diagnosis(case_set, concurrency, config):
+    def job(item):
+        current_case, _ = item
+        with trace_context(case_id=current_case['case_id']):
+            return hierachy_diagnosis(case_set.dataset, current_case, config)
+
+    failures = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _, _, error in bounded_map(job, case_set.iter_cases(), concurrency):
+            if error is not None:
+                failures += 1
+    return failures
+
+def run_main(case_set, concurrency, args):
+    argv = ['--dataset', 'synthetic', '--unify_model', 'mock', '--disable_logging', '--concurrency', str(concurrency)]
+    if args.level1_sampling:
+        argv.append('--level1_sampling')
+    if args.stream:
+        argv.append('--stream')
+    if args.level1_confidence:
+        argv += ['--level1_confidence', str(args.level1_confidence)]
+    if args.report_tokens:
+        argv += ['--report_tokens', str(args.report_tokens)]
+    if args.report_summarizer:
+        argv.append('--report_summarizer')
+    with contextlib.redirect_stdout(io.StringIO()):
+        ucagents_main.main(argv, case_set=case_set)
+    return 0
+
+def benchmark(args, concurrency):
+    mock = MockClient(
+        latency=make_latency_sampler(args.latency_dist, args.latency_mean, args.latency_spread),
+        refusal_rate=args.refusal_rate,
+        error_rate=args.error_rate,
+        token_latency=args.token_latency,
+        trailing_text=' Additional notes.' * (args.trailing_chars // 18) if args.trailing_chars else '',
+    )
+    set_client_factory(lambda base_url, api_key: mock)
+    # main mode sizes the pool itself from its own flags
+    configure_fan_out(4 * concurrency)
+    configure_tracer(True)
+    case_set = SyntheticCaseSet(args.cases, args.image_size)
+
+    wall_start = time.time()
+    cpu_start = time.process_time()
+    if args.mode == 'diagnosis':
+        failures = run_diagnosis(case_set, concurrency, DiagnosisConfig(level1_sampling=args.level1_sampling, stream=args.stream, level1_confidence=args.level1_confidence or None, report_tokens=args.report_tokens or None, report_summarizer=args.report_summarizer))
+    else:
+        failures = run_main(case_set, concurrency, args)
+    wall = time.time() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    spans = get_tracer().spans if args.mode == 'diagnosis' else []
+    return {
+        'mode': args.mode,
+        'concurrency': concurrency,
+        'cases': args.cases,
+        'failures': failures,
+        'wall_seconds': wall,
+        'cases_per_sec': args.cases / wall if wall > 0 else 0.0,
+        'calls': mock.calls,
+        'calls_per_case': mock.calls / args.cases if args.cases else 0.0,
+        'cpu_ms_per_call': cpu * 1000 / mock.calls if mock.calls else 0.0,
+        'mean_span_seconds': sum(s['duration'] for s in spans) / len(spans) if spans else None,
+    }
+
+def main():
+    args = parse_arguments()
+    results = [benchmark(args, concurrency) for concurrency in args.concurrency]
+    set_client_factory(None)
+
+    print('mode | concurrency | cases/s | calls/case | cpu ms/call | failures')
+    for r in results:
+        print(f"{r['mode']} | {r['concurrency']} | {r['cases_per_sec']:.2f} | {r['calls_per_case']:.2f} | {r['cpu_ms_per_call']:.3f} | {r['failures']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import threading
+
+# Token budget for escalation. A BudgetGovernor holds the per-run limit shared by every case; each case
+# gets a CaseBudget that is charged from its live token_usage and decides how far the hierarchy may go.
+# Level-1 always runs; Level-2, the Level-3 panel size and the rebuttal round are cut when over budget.
+# Once the run budget is spent, admit() stops handing out new cases.
+
+class BudgetGovernor:
+    def __init__(self, case_tokens=None, run_tokens=None, max_panel=None, call_tokens=2000):
+        self.case_tokens = case_tokens
+        self.run_tokens = run_tokens
+        # hard cap on Level-3 critics, independent of spend
+        self.max_panel = max_panel
+        # cost guess for one call until the case has spent something to average over
+        self.call_tokens = call_tokens
+        self.spent = 0
+        # set when admit() held cases back because the run budget was spent
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def open_case(self):
+        return CaseBudget(self)
+
+    def charge(self, tokens):
+        with self.lock:
+            self.spent += tokens
+
+    def run_remaining(self):
+        if self.run_tokens is None:
+            return None
+        with self.lock:
+            return self.run_tokens - self.spent
+
+    def exhausted(self):
+        remaining = self.run_remaining()
+        return remaining is not None and remaining <= 0
+
+    def admit(self, cases):
+        # Passes cases through until the run budget is spent; later cases are not started at all.
+        for case in cases:
+            if self.exhausted():
+                self.stopped = True
+                print(f'[BUDGET] run token budget of {self.run_tokens} spent, no further cases are started')
+                return
+            yield case
+
+class CaseBudget:
+    def __init__(self, governor=None):
+        self.governor = governor or BudgetGovernor()
+        self.spent = 0
+        self.calls = 0
+        self.decisions = []
+
+    def sync(self, token_usage, calls=0):
+        # charge the run with whatever this case has spent since the last sync
+        delta = token_usage['total_tokens'] - self.spent
+        self.spent = token_usage['total_tokens']
+        self.calls += calls
+        if delta:
+            self.governor.charge(delta)
+
+    def remaining(self):
+        limits = []
+        if self.governor.case_tokens is not None:
+            limits.append(self.governor.case_tokens - self.spent)
+        run_remaining = self.governor.run_remaining()
+        if run_remaining is not None:
+            limits.append(run_remaining)
+        return min(limits) if limits else None
+
+    def call_cost(self):
+        # the case's own average so far; later prompts carry earlier reports, so this is a lower bound
+        if self.calls == 0:
+            return self.governor.call_tokens
+        return self.spent / self.calls
+
+    def affords(self, calls):
+        remaining = self.remaining()
+        return remaining is None or calls * self.call_cost() <= remaining
+
+    def record(self, decision, **detail):
+        entry = {'decision': decision, 'spent': self.spent, 'remaining': self.remaining()}
+        entry.update(detail)
+        self.decisions.append(entry)
+        print(f'[BUDGET] {decision}: {detail}')
+
+    def allow(self, decision, calls, **detail):
+        if self.affords(calls):
+            return True
+        self.record(decision, calls=calls, **detail)
+        return False
+
+    def panel_size(self, options):
+        # a Level-3 round costs ~2 calls per critic (critique + rebuttal) plus leader and final leader;
+        # shrink the panel to what fits, but never below two or there is nothing to debate
+        size = options
+        if self.governor.max_panel is not None and size > self.governor.max_panel:
+            size = max(self.governor.max_panel, 2)
+        while size > 2 and not self.affords(2 * size + 2):
+            size -= 1
+        if size < options:
+            self.record('cap_panel', options=options, panel=size)
+        return size
@@ -0,0 +1,72 @@
+import json
+import mmap
+from io import BytesIO
+from pathlib import Path
+from PIL import Image
+from image_cache import compute_digest, encode_jpeg, seed_image
+
+# A prepared case store is a directory holding:
+#   index.json  - dataset name, encode settings and one entry per case (question, gt, blob offset/length,
+#                 pixel digest of the stored JPEG)
+#   images.bin  - the pre-encoded JPEG bytes of every case image, back to back
+
+def prepare_case_store(case_set, path, max_side=None, quality=90):
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    entries = []
+    with open(path / 'images.bin', 'wb') as blob:
+        for case, gt_option in case_set.iter_cases():
+            entry = {'case_id': case['case_id'], 'question': case['question'], 'gt': gt_option, 'offset': None, 'length': 0, 'digest': None}
+            if case['image'] is not None:
+                data = encode_jpeg(case['image'], max_side, quality)
+                entry['offset'] = blob.tell()
+                entry['length'] = len(data)
+                # digest of the pixels a run will load, so loading a case never has to decode it
+                entry['digest'] = compute_digest(Image.open(BytesIO(data)))
+                blob.write(data)
+            entries.append(entry)
+
+    meta = {'dataset': case_set.dataset, 'max_side': max_side, 'quality': quality, 'cases': entries}
+    with open(path / 'index.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return len(entries)
+
+class CaseStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / 'index.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dataset = meta['dataset']
+        self.max_side = meta['max_side']
+        self.quality = meta['quality']
+        self.cases = meta['cases']
+
+        self.blob_file = open(self.path / 'images.bin', 'rb')
+        size = self.blob_file.seek(0, 2)
+        # an empty file cannot be mapped (text-only datasets)
+        self.blob = mmap.mmap(self.blob_file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+
+    def __len__(self):
+        return len(self.cases)
+
+    def jpeg_bytes(self, entry):
+        if entry['offset'] is None:
+            return None
+        # one copy out of the map; BytesIO and the image cache share it, and no view pins the map open
+        return self.blob[entry['offset']:entry['offset'] + entry['length']]
+
+    def load_case(self, entry):
+        image = None
+        data = self.jpeg_bytes(entry)
+        if data is not None:
+            image = Image.open(BytesIO(data))
+            # the stored bytes double as the request payload when the encode settings match; Image.open
+            # only reads the header, and with the stored digest nothing is decoded here
+            seed_image(image, data, self.max_side, self.quality, entry.get('digest'))
+        return {'question': entry['question'], 'image': image, 'case_id': entry['case_id']}, entry['gt']
+
+    def close(self):
+        if self.blob is not None:
+            self.blob.close()
+        self.blob_file.close()
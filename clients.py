@@ -0,0 +1,71 @@
+import threading
+import httpx
+from openai import OpenAI
+
+API_BASE = 'YOUR_API'
+API_KEY = 'YOUR_KEY'
+LOCAL_API_BASE = 'http://localhost:11434/v1' # change to your local url.
+LOCAL_API_KEY = '111'
+
+_pool_config = {
+    'max_connections': 64,
+    'max_keepalive_connections': 32,
+    'keepalive_expiry': 30.0,
+    'timeout': 600.0,
+    'http2': True,
+}
+_clients = {}
+_lock = threading.Lock()
+_client_factory = None
+
+def configure_clients(**kwargs):
+    # Must be called before the first Agent is created; existing clients are closed and rebuilt lazily.
+    for k in kwargs:
+        if k not in _pool_config:
+            raise ValueError(f'Unknown client pool option: {k}')
+    _pool_config.update(kwargs)
+    close_clients()
+
+def http2_available():
+    try:
+        import h2
+    except ImportError:
+        return False
+    return True
+
+def set_client_factory(factory):
+    # factory(base_url, api_key) -> client; used to swap in mock_backend.MockClient. None restores OpenAI.
+    global _client_factory
+    close_clients()
+    _client_factory = factory
+
+def get_client(base_url=API_BASE, api_key=API_KEY):
+    # One pooled client per endpoint, shared by every Agent in the process.
+    key = (base_url, api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None and _client_factory is not None:
+            client = _client_factory(base_url, api_key)
+            _clients[key] = client
+        elif client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=_pool_config['max_connections'],
+                    max_keepalive_connections=_pool_config['max_keepalive_connections'],
+                    keepalive_expiry=_pool_config['keepalive_expiry'],
+                ),
+                timeout=_pool_config['timeout'],
+                # HTTP/2 is negotiated via ALPN, so plain-http local servers stay on HTTP/1.1
+                http2=_pool_config['http2'] and http2_available(),
+            )
+            # retries are owned by ratelimit.EndpointLimiter so they share one backoff and budget
+            client = OpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+            _clients[key] = client
+    return client
+
+def close_clients():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
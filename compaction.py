@@ -0,0 +1,54 @@
+import re
+
+# Report compaction between levels. Every Level-3 critic and leader prompt carries the earlier reports,
+# so each report section is held to a token cap: extractively (leading and closing sentences, plus the
+# answer field) or, with a summarizer, by a cheap condensing call whose output is capped the same way.
+
+CHARS_PER_TOKEN = 4  # same rough estimate as ratelimit.estimate_tokens
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+ANSWER_FIELD = re.compile(r'#\s*(?:Final\s+)?Answer\s*:[^\n#.]{0,40}\.?', re.IGNORECASE)
+OMITTED = '[...]'
+
+def text_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+def over_cap(text, max_tokens):
+    return max_tokens is not None and text_tokens(text) > max_tokens
+
+def compact_text(text, max_tokens):
+    # Returns `text` within ~max_tokens. The answer field is kept whole; of the rest, sentences are taken
+    # alternately from the start (observations) and the end (conclusion) while they fit, in original order.
+    if not over_cap(text, max_tokens):
+        return text
+    budget = max_tokens * CHARS_PER_TOKEN
+    answer = ANSWER_FIELD.search(text)
+    tail = answer.group(0).strip() if answer else ''
+    body = text[:answer.start()] + text[answer.end():] if answer else text
+    budget -= len(tail) + len(OMITTED) + 2
+
+    sentences = [s for s in SENTENCE_END.split(body.strip()) if s]
+    order = []
+    lo, hi = 0, len(sentences) - 1
+    while lo <= hi:
+        order.append(lo)
+        if hi != lo:
+            order.append(hi)
+        lo, hi = lo + 1, hi - 1
+    kept = set()
+    for i in order:
+        cost = len(sentences[i]) + 1
+        if cost > budget:
+            break
+        kept.add(i)
+        budget -= cost
+
+    if not kept and sentences:
+        # a single overlong sentence: hard cut
+        return ' '.join(part for part in (sentences[0][:max(budget, 0)], OMITTED, tail) if part)
+    parts = []
+    for i, sentence in enumerate(sentences):
+        if i in kept:
+            parts.append(sentence)
+        elif parts[-1:] != [OMITTED]:
+            parts.append(OMITTED)
+    return ' '.join(parts + ([tail] if tail else []))
@@ -0,0 +1,104 @@
+import json
+from agents import RefusalRetryPolicy
+from budget import BudgetGovernor
+from endpoints import get_endpoint_pool
+
+# Roles that can be routed to their own model. Rebuttals are answered by the critic's own conversation.
+ROUTE_ROLES = ('expert', 'checker', 'critic', 'leader', 'final_leader', 'summarizer')
+# Roles whose reply ends in their own answer field, so a stream can stop there.
+ANSWER_ROLES = ('expert', 'checker', 'final_leader')
+ROUTE_KEYS = ('model', 'local', 'base_url', 'api_key', 'temperature', 'max_tokens', 'pool')
+
+def load_routes(path):
+    # {"default": {...}, "<role>": {"model": ..., "base_url": ..., "api_key": ..., "local": ..., "temperature": ..., "max_tokens": ..., "pool": ...}}
+    with open(path, 'r', encoding='utf-8') as f:
+        routes = json.load(f)
+    for role, route in routes.items():
+        if role != 'default' and role not in ROUTE_ROLES:
+            raise ValueError(f'Unknown routing role: {role}')
+        for k in route:
+            if k not in ROUTE_KEYS:
+                raise ValueError(f'Unknown routing option for {role}: {k}')
+    return routes
+
+class DiagnosisConfig:
+    # Knobs for a single hierachy_diagnosis run; defaults reproduce the original pipeline.
+    def __init__(self, level1_experts=2, level1_sampling=False, history='full', max_history_turns=None, retry_policy=None, budget=None, model=None, routes=None, stream=False, level1_confidence=None, report_tokens=None, report_summarizer=False, distinct_experts=False):
+        self.level1_experts = level1_experts
+        # draw all Level-1 opinions from one request with n=level1_experts
+        self.level1_sampling = level1_sampling
+        # conversation history policy for every agent, see Agent.__init__
+        self.history = history
+        self.max_history_turns = max_history_turns
+        # agents.RefusalRetryPolicy shared by every agent, None uses the default
+        self.retry_policy = retry_policy
+        # budget.BudgetGovernor shared by every case of the run, None means unlimited
+        self.budget = budget
+        # model for every role (--unify_model), overridden per role by `routes`, see load_routes
+        self.model = model
+        self.routes = routes or {}
+        # stream completions; ANSWER_ROLES stop at the answer field, see Agent._stream
+        self.stream = stream
+        # finish at Level-1 when all experts agree and each gave its answer letter at least this probability
+        # (from token logprobs); None always sends an agreement on to the Level-2 check
+        self.level1_confidence = level1_confidence
+        # cap in tokens for each report section carried into Level-3 prompts, None keeps reports verbatim
+        self.report_tokens = report_tokens
+        # condense over-cap Level-1/Level-2 sections with a 'summarizer' call instead of extractive trimming
+        self.report_summarizer = report_summarizer
+        # give each Level-1 expert its own sampling seed, so their otherwise identical requests get their own
+        # response cache entries and batch lines; off by default to leave sampling to the server
+        self.distinct_experts = distinct_experts
+
+    def route(self, role=None):
+        route = {'model': self.model} if self.model else {}
+        route.update(self.routes.get('default', {}))
+        route.update(self.routes.get(role, {}))
+        return route
+
+    def temperature(self, role, default):
+        return self.route(role).get('temperature', default)
+
+    def agent_kwargs(self, role=None):
+        kwargs = {'history': self.history, 'max_history_turns': self.max_history_turns, 'retry_policy': self.retry_policy, 'stream': self.stream}
+        if self.stream and role in ANSWER_ROLES:
+            kwargs['stop_at_answer'] = True
+        if role == 'expert' and self.level1_confidence is not None:
+            kwargs['logprobs'] = True
+        if self.report_tokens is not None:
+            kwargs['reply_tokens'] = self.report_tokens
+        route = self.route(role)
+        if 'model' in route:
+            kwargs['model_info'] = route['model']
+        for k in ('local', 'base_url', 'api_key', 'max_tokens'):
+            if k in route:
+                kwargs[k] = route[k]
+        if 'base_url' not in route:
+            # without an explicit endpoint the role goes to its named pool, or the default pool if one is configured
+            pool = get_endpoint_pool(route.get('pool', 'default'))
+            if pool is None and 'pool' in route:
+                raise ValueError(f"Unknown endpoint pool for {role}: {route['pool']}")
+            kwargs['pool'] = pool
+        return kwargs
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            level1_experts=args.level1_experts,
+            level1_sampling=args.level1_sampling,
+            history=args.history,
+            max_history_turns=args.max_history_turns if args.max_history_turns >= 0 else None,
+            retry_policy=RefusalRetryPolicy(max_attempts=args.refusal_attempts, temperatures=args.refusal_temperatures),
+            budget=BudgetGovernor(
+                case_tokens=args.case_token_budget or None,
+                run_tokens=args.run_token_budget or None,
+                max_panel=args.max_panel or None,
+            ),
+            model=args.unify_model or None,
+            routes=load_routes(args.routing) if args.routing else None,
+            stream=args.stream,
+            level1_confidence=args.level1_confidence or None,
+            report_tokens=args.report_tokens or None,
+            report_summarizer=args.report_summarizer,
+            distinct_experts=args.response_cache != 'off' or bool(args.batch_dir),
+        )
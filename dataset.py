@@ -1,103 +1,165 @@
 import random
 import json
-from datasets import load_dataset
+from datasets import load_dataset, Image as ImageFeature
+from case_store import CaseStore
+
+YES_NO = ('yes', 'no')
 
 class DataLoader:
-    def __init__(self, dataset='pathvqa', num_samples=-1, shuffle=False):
+    def __init__(self, dataset='pathvqa', num_samples=-1, shuffle=False, case_store=None, decode_images=True):
         self.dataset = dataset
         self.num_samples = num_samples
         self.shuffle = shuffle
+        self.case_store = case_store
+        self.store = None
+        # False leaves images as encoded file bytes, for prefetch.prefetch_cases to decode in its workers
+        self.decode_images = decode_images
 
         self.qa_datas = []
         self.cases = []
         self.gt_options = []
         self.temp_list=[]
+        self.loaded = False
 
     def build_all_data(self):
-        _ = self.load_data()
-        self.build_cases()
+        self.cases = []
+        self.gt_options = []
+        for built_case, gt_option in self.iter_cases():
+            self.cases.append(built_case)
+            self.gt_options.append(gt_option)
 
         return self.cases, self.gt_options
 
-    def build_cases(self):
-        self.cases = []
+    def __len__(self):
+        if not self.loaded:
+            self.load_data()
+        return len(self.qa_datas)
+
+    def iter_cases(self, skip_ids=()):
+        # Yields (case, gt_option) one at a time; images are decoded and converted only when their case is reached.
+        if not self.loaded:
+            self.load_data()
 
-        l = len(self.qa_datas)
-        for i in range(l):
-            c = self.qa_datas[i]
+        if self.store is not None:
+            for entry in self.qa_datas:
+                if entry['case_id'] in skip_ids:
+                    continue
+                yield self.store.load_case(entry)
+            return
+
+        qa_datas = self.qa_datas
+        if isinstance(qa_datas, list):
+            qa_datas = [c for c in qa_datas if c['row_id'] not in skip_ids]
+        else:
+            # skipped rows are dropped by their row_id column alone, since fetching a row decodes its image
+            qa_datas = qa_datas.select([i for i, row_id in enumerate(qa_datas['row_id']) if row_id not in skip_ids])
+        for c in qa_datas:
+            row_id = c['row_id']
             if len(self.temp_list)>0:
-                built_case, gt_option = self.create_case(c, self.temp_list[i])
+                built_case, gt_option = self.create_case(c, self.temp_list[row_id])
             else:
                 built_case, gt_option = self.create_case(c)
             if not built_case:
                 continue
-            self.cases.append(built_case)
-            self.gt_options.append(gt_option)
+            built_case['case_id'] = row_id
+            yield built_case, gt_option
+
+    def build_cases(self):
+        return self.build_all_data()
 
     def load_data(self):
         self.qa_datas = []
-
-        if self.dataset == 'medqa':
+        self.temp_list = []
+
+        if self.case_store:
+            self.store = CaseStore(self.case_store)
+            if self.store.dataset != self.dataset:
+                raise ValueError(f'Case store {self.case_store} holds {self.store.dataset}, not {self.dataset}')
+            self.qa_datas = list(self.store.cases)
+            if self.shuffle:
+                random.shuffle(self.qa_datas)
+            if self.num_samples != -1 and self.num_samples>0:
+                self.qa_datas = self.qa_datas[:self.num_samples]
+
+        elif self.dataset == 'medqa':
             test_path = f'./data/{self.dataset}/test.jsonl'
             with open(test_path, 'r') as file:
-                for line in file:
-                    self.qa_datas.append(json.loads(line))
-
-        elif self.dataset == 'pathvqa':
-            dataset = load_dataset("flaviagiammarino/path-vqa", split="test")
-            for i in range(0,len(dataset)):
-                if dataset[i]['answer'] not in ['no', 'yes']:
-                    continue
-                self.qa_datas.append(dataset[i])
-
-        elif self.dataset == 'vqa-rad':
-            dataset = load_dataset("flaviagiammarino/vqa-rad", split="test")
-            options_path = './data/vqa-rad/answer.json'
-            with open(options_path, 'r') as file:
-                options = json.load(file)
-            for i in range(0,len(dataset)):
-                self.qa_datas.append(dataset[i])
-                self.temp_list.append(options[i])
-            self.qa_datas = [self.qa_datas[k-1] for k in l]
+                for row_id, line in enumerate(file):
+                    sample = json.loads(line)
+                    sample['row_id'] = row_id
+                    self.qa_datas.append(sample)
+            if self.shuffle:
+                random.shuffle(self.qa_datas)
+            if self.num_samples != -1 and self.num_samples>0:
+                self.qa_datas = self.qa_datas[:self.num_samples]
 
-        elif self.dataset == 'slake-vqa':
-            dataset = load_dataset("mdwiratathya/SLAKE-vqa-english", split="test")
-            options_path = './data/slake-vqa/answer.json'
-            with open(options_path, 'r') as file:
-                options = json.load(file)
-            for i in range(0,len(dataset)):
-                if dataset[i]['answer'].lower() not in ['yes','no']:
-                    continue
-                self.qa_datas.append(dataset[i])
-                self.temp_list.append(options[i])
         else:
-            print('The dataset is not supported. Exit.')
-            exit()
-
-        if self.shuffle:
-            random.shuffle(self.qa_datas)
-        if self.num_samples != -1 and self.num_samples>0:
-            self.qa_datas = self.qa_datas[:self.num_samples]
+            if self.dataset == 'pathvqa':
+                dataset = load_dataset("flaviagiammarino/path-vqa", split="test")
+                keep = lambda answers: [a in YES_NO for a in answers]
+
+            elif self.dataset == 'vqa-rad':
+                dataset = load_dataset("flaviagiammarino/vqa-rad", split="test")
+                options_path = './data/vqa-rad/answer.json'
+                with open(options_path, 'r') as file:
+                    self.temp_list = json.load(file)
+                keep = None
+
+            elif self.dataset == 'slake-vqa':
+                dataset = load_dataset("mdwiratathya/SLAKE-vqa-english", split="test")
+                options_path = './data/slake-vqa/answer.json'
+                with open(options_path, 'r') as file:
+                    self.temp_list = json.load(file)
+                keep = lambda answers: [a.lower() in YES_NO for a in answers]
+            else:
+                print('The dataset is not supported. Exit.')
+                exit()
+
+            # row_id keeps each case tied to its original split row (and answer.json entry) through filter/shuffle/select
+            dataset = dataset.add_column('row_id', list(range(len(dataset))))
+            if not self.decode_images:
+                dataset = dataset.cast_column('image', ImageFeature(decode=False))
+            if keep is not None:
+                # batched filter only reads the answer column, images are not decoded here
+                dataset = dataset.filter(keep, batched=True, input_columns=['answer'])
+            if self.shuffle:
+                dataset = dataset.shuffle()
+            if self.num_samples != -1 and self.num_samples>0:
+                dataset = dataset.select(range(min(self.num_samples, len(dataset))))
+            self.qa_datas = dataset
+
+        self.loaded = True
         print('Test Samples Total: ',len(self.qa_datas))
         return self.qa_datas
 
+    def load_image(self, image):
+        if not self.decode_images:
+            if image.get('bytes') is not None:
+                return image['bytes']
+            with open(image['path'], 'rb') as f:
+                return f.read()
+        return image.convert('RGB')
+
     def create_case(self, sample, temp=None):
+        # option order is a function of the case (its original row), so reruns rebuild byte-identical prompts
+        # for the response cache and batch files
+        rng = random.Random(sample['row_id'])
         if self.dataset == 'medqa':
             question = "Case: " + sample['question'] + "\nOptions:"
             options = []
             for k, v in sample['options'].items():
                 options.append("\n({}){}".format(k, v))
-            random.shuffle(options)
+            rng.shuffle(options)
             question += " ".join(options)
-            return {'question': question, 'image': sample['image']}, sample['answer_idx']
+            return {'question': question, 'image': sample.get('image')}, sample['answer_idx']
 
         elif self.dataset == 'pathvqa':
             question = 'Question: ' + sample['question'] + '\nOptions:'
             options = [f"(A)yes", f"(B)no"]
-            random.shuffle(options)
+            rng.shuffle(options)
             question += ' '.join(options)
 
-            pil_image = sample['image'].convert('RGB')
+            pil_image = self.load_image(sample['image'])
             return {'question': question, 'image': pil_image}, {'yes':'A','no':'B'}[sample['answer']]
 
         elif self.dataset == 'vqa-rad':
@@ -110,10 +172,10 @@ class DataLoader:
                 options.append("\n({}){}".format(idx[i], candi_options[i]))
                 if candi_options[i].lower() == temp['answer'].lower():
                     answer_idx = idx[i]
-                
-            random.shuffle(options)
+
+            rng.shuffle(options)
             question += " ".join(options)
-            pil_image = sample['image'].convert('RGB') 
+            pil_image = self.load_image(sample['image'])
             return {'question': question, 'image': pil_image}, answer_idx
 
         elif self.dataset == 'slake-vqa':
@@ -126,7 +188,7 @@ class DataLoader:
                 options.append("\n({}){}".format(idx[i], candi_options[i]))
                 if candi_options[i].lower() == temp['answer'].lower():
                     answer_idx = idx[i]
-            random.shuffle(options)
+            rng.shuffle(options)
             question += " ".join(options)
-            pil_image = sample['image'].convert('RGB') 
-            return {'question': question, 'image': pil_image}, answer_idx
\ No newline at end of file
+            pil_image = self.load_image(sample['image'])
+            return {'question': question, 'image': pil_image}, answer_idx
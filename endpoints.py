@@ -0,0 +1,162 @@
+import json
+import random
+import threading
+from contextlib import contextmanager
+from clients import get_client, LOCAL_API_KEY
+from ratelimit import is_connection_error
+
+# Pools of OpenAI-compatible servers serving the same models, e.g. one Ollama/vLLM instance per GPU.
+# A request goes to the healthy endpoint with the fewest outstanding requests per unit of weight. With sticky
+# routing an agent keeps the endpoint of its first request for the whole conversation, so follow-up turns
+# hit the server that already holds its prefix cache. Each endpoint keeps its own rate limiter.
+
+ENDPOINT_KEYS = ('base_url', 'api_key', 'weight')
+
+class Endpoint:
+    def __init__(self, base_url, api_key=LOCAL_API_KEY, weight=1.0):
+        if weight <= 0:
+            raise ValueError(f'Endpoint weight must be positive: {base_url}')
+        self.base_url = base_url
+        self.api_key = api_key
+        self.weight = weight
+        self.outstanding = 0
+        self.requests = 0
+        # consecutive requests that could not reach the server
+        self.failures = 0
+        self.healthy = True
+        self.last_error = None
+
+    @property
+    def client(self):
+        return get_client(self.base_url, self.api_key)
+
+class EndpointPool:
+    def __init__(self, endpoints, sticky=True, max_failures=3, health_interval=30.0, health_timeout=5.0):
+        if not endpoints:
+            raise ValueError('An endpoint pool needs at least one endpoint')
+        self.endpoints = endpoints
+        self.sticky = sticky
+        # connection failures in a row before an endpoint is taken out until a health check passes
+        self.max_failures = max_failures
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.checker = None
+
+    def choose(self, exclude=()):
+        # least outstanding requests per unit of weight among healthy endpoints; if every endpoint is down,
+        # route anyway rather than fail the case
+        with self.lock:
+            candidates = [e for e in self.endpoints if e.healthy and e not in exclude]
+            candidates = candidates or [e for e in self.endpoints if e not in exclude] or self.endpoints
+            # random tie-break, so equally loaded endpoints share new conversations
+            return min(candidates, key=lambda e: ((e.outstanding + 1) / e.weight, random.random()))
+
+    def has_alternative(self, endpoint, exclude=()):
+        with self.lock:
+            return any(e is not endpoint and e.healthy and e not in exclude for e in self.endpoints)
+
+    @contextmanager
+    def track(self, endpoint):
+        with self.lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        try:
+            yield
+        except Exception as e:
+            if is_connection_error(e):
+                self.mark_failure(endpoint, e)
+            raise
+        else:
+            with self.lock:
+                endpoint.failures = 0
+        finally:
+            with self.lock:
+                endpoint.outstanding -= 1
+
+    def mark_failure(self, endpoint, error):
+        with self.lock:
+            endpoint.failures += 1
+            endpoint.last_error = str(error)
+            if endpoint.healthy and endpoint.failures >= self.max_failures:
+                endpoint.healthy = False
+                print(f'[ENDPOINT] {endpoint.base_url} marked down: {error}')
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.models.list(timeout=self.health_timeout)
+            except Exception as e:
+                with self.lock:
+                    if endpoint.healthy:
+                        print(f'[ENDPOINT] {endpoint.base_url} failed health check: {e}')
+                    endpoint.healthy = False
+                    endpoint.last_error = str(e)
+            else:
+                with self.lock:
+                    if not endpoint.healthy:
+                        print(f'[ENDPOINT] {endpoint.base_url} is back')
+                    endpoint.healthy = True
+                    endpoint.failures = 0
+
+    def start_health_checks(self):
+        self.check_health()
+        if self.health_interval <= 0 or self.checker is not None:
+            return
+
+        def loop():
+            while not self.stopped.wait(self.health_interval):
+                self.check_health()
+
+        self.checker = threading.Thread(target=loop, daemon=True)
+        self.checker.start()
+
+    def close(self):
+        self.stopped.set()
+
+    def stats(self):
+        with self.lock:
+            return [{
+                'base_url': e.base_url,
+                'weight': e.weight,
+                'healthy': e.healthy,
+                'outstanding': e.outstanding,
+                'requests': e.requests,
+                'last_error': e.last_error,
+            } for e in self.endpoints]
+
+def load_endpoint_pools(path, **kwargs):
+    # {"default": [{"base_url": ..., "api_key": ..., "weight": ...}, ...], "<pool name>": [...]}; a route picks
+    # a named pool with "pool", every agent without its own base_url uses "default"
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    pools = {}
+    for name, entries in spec.items():
+        endpoints = []
+        for entry in entries:
+            for k in entry:
+                if k not in ENDPOINT_KEYS:
+                    raise ValueError(f'Unknown endpoint option in pool {name}: {k}')
+            endpoints.append(Endpoint(entry['base_url'], entry.get('api_key', LOCAL_API_KEY), entry.get('weight', 1.0)))
+        pools[name] = EndpointPool(endpoints, **kwargs)
+    return pools
+
+_pools = {}
+
+def configure_endpoint_pools(pools):
+    close_endpoint_pools()
+    _pools.update(pools)
+    for pool in _pools.values():
+        pool.start_health_checks()
+
+def get_endpoint_pool(name='default'):
+    return _pools.get(name)
+
+def endpoint_stats():
+    return {name: pool.stats() for name, pool in _pools.items()}
+
+def close_endpoint_pools():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
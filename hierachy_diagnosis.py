@@ -1,14 +1,63 @@
 from agents import Agent
 from utils import extract_option, count_token_usage
+from scheduler import fan_out
+from config import DiagnosisConfig
+from tracing import trace_context
+from budget import CaseBudget
+from compaction import compact_text, over_cap
 # Remeber to replace words in <> in prompts.
 
-def level_2_diagnosis(dataset, medical_case, medical_image, level1_report, token_usage):
+# The pipeline is written as generators (`*_steps`) that yield one Step of independent calls at a time and
+# receive the replies back. run_steps drives one case depth-first; stagewise.py drives many cases in lockstep.
+STAGES = ('level-1', 'level-2', 'level-3-compact', 'level-3-critic', 'level-3-leader', 'level-3-rebuttal', 'level-3-final')
+
+class Call:
+    def __init__(self, agent, message, image=None, temperature=0.0, n=1):
+        self.agent = agent
+        self.message = message
+        self.image = image
+        self.temperature = temperature
+        self.n = n
+
+    def run(self):
+        if self.n > 1:
+            return self.agent.chat_n(self.message, self.image, temperature=self.temperature, n=self.n)
+        return self.agent.chat(self.message, self.image, self.temperature)
+
+    def request_body(self):
+        return self.agent.preview_request(self.message, self.image, self.temperature, self.n)
+
+class Step:
+    def __init__(self, stage, level, role, calls):
+        self.stage = stage
+        self.level = level
+        self.role = role
+        self.calls = calls
+
+def run_steps(steps):
+    replies = None
+    while True:
+        try:
+            step = steps.send(replies)
+        except StopIteration as stop:
+            return stop.value
+        with trace_context(level=step.level, role=step.role):
+            replies = fan_out([call.run for call in step.calls])
+
+def new_agent(config, role=None, **kwargs):
+    return Agent(**config.agent_kwargs(role), **kwargs)
+
+def level_2_diagnosis(dataset, medical_case, medical_image, level1_report, token_usage, config=None):
+    return run_steps(level_2_steps(dataset, medical_case, medical_image, level1_report, token_usage, config))
+
+def level_2_steps(dataset, medical_case, medical_image, level1_report, token_usage, config=None):
+    config = config or DiagnosisConfig()
     print("\n=====[LEVEL-2] Extra Expert Assessment=====")
-    expert = Agent()
+    expert = new_agent(config, 'checker')
 
     query = """[Core Identity] You are an authoritative senior <MEDICAL FIELD> expert, highly proficient in <IMAGING MODALITIES> interpretation and diagnostic reasoning. Your role is to critically verify the consensus diagnosis made by two prior <MEDICAL FIELD> experts, ensuring it is logically sound, evidence-based, and consistent with <IMAGING MODALITIES> image features. [Task Focus] 1. First check the input image and read the question. 2. Evaluate whether the shared judgment aligns with the observed image findings and <IMAGING MODALITIES> criteria. 3. Identify any potential misinterpretation or overconfidence. 4. If their consensus is valid, reaffirm it; if not, provide your corrected final diagnosis. [Current Case] {medical_case}. [Previous Reports] {level1_report}. [Output Format] #Review Reasoning: <Write a rigorous 3-5 sentence paragraph explaining (1) the observed image evidence, (2) the logic of the prior judgments, (3) potential flaws or confirmations, (4) your diagnostic reasoning, and (5) your conclusion.> #Answer: <a single letter of your choice, e.g. A or B>.""".format(medical_case=medical_case,level1_report=level1_report)
 
-    response = expert.chat(query, medical_image, 0.5)
+    response, = yield Step('level-2', 2, 'checker', [Call(expert, query, medical_image, config.temperature('checker', 0.5))])
 
     try:
         level2_option = extract_option(response.split('#')[-1].split(':')[-1])
@@ -21,66 +70,137 @@ def level_2_diagnosis(dataset, medical_case, medical_image, level1_report, token
 
     return level2_option, response, token_usage
 
-def level_3_diagnosis(medical_case, medical_image, latest_report, level1_report_dict, token_usage):
+def compact_report_steps(sections, token_usage, config, budget):
+    # Holds each report section (header, text) to config.report_tokens before the report is pasted into every
+    # Level-3 prompt; over-cap sections are condensed by a summarizer when enabled, then trimmed to the cap.
+    cap = config.report_tokens
+    texts = [text for _, text in sections]
+    long = [i for i, text in enumerate(texts) if over_cap(text, cap)]
+    if long and config.report_summarizer and budget.allow('skip_summaries', len(long), sections=len(long)):
+        summarizers = [new_agent(config, 'summarizer') for _ in long]
+        summary_calls = []
+        for i, summarizer in zip(long, summarizers):
+            query = """[Core Identity] You are a precise medical scribe. [Task] Condense the diagnostic report below to at most {words} words. Keep the chosen option, the key image findings and the decisive reasoning; do not add, judge or change anything. Output only the condensed report. [Report] {report}""".format(words=cap * 3 // 4, report=texts[i])
+            summary_calls.append(Call(summarizer, query, None, config.temperature('summarizer', 0.0)))
+        summaries = yield Step('level-3-compact', 3, 'summarizer', summary_calls)
+        for i, summary in zip(long, summaries):
+            texts[i] = summary
+        for summarizer in summarizers:
+            token_usage = count_token_usage(token_usage, summarizer.get_token_usage())
+        budget.sync(token_usage, calls=len(summarizers))
+    if long:
+        print(f'[COMPACT] {len(long)} of {len(sections)} report sections held to {cap} tokens')
+    return [(header, compact_text(text, cap)) for (header, _), text in zip(sections, texts)], token_usage
+
+def level_3_diagnosis(medical_case, medical_image, latest_report, level1_report_dict, token_usage, config=None, budget=None):
+    return run_steps(level_3_steps(medical_case, medical_image, latest_report, level1_report_dict, token_usage, config, budget))
+
+def level_3_steps(medical_case, medical_image, latest_report, level1_report_dict, token_usage, config=None, budget=None):
+    config = config or DiagnosisConfig()
+    budget = budget or CaseBudget()
     print("\n=====[LEVEL-3] Expert Panel Debate=====")
-    print(f"{len(level1_report_dict)} experts are recruited to check options: {[o for o in level1_report_dict.keys()]}")
+    # when the panel is capped, keep the options with the most supporting reports
+    panel = budget.panel_size(len(level1_report_dict))
+    options = sorted(level1_report_dict.keys(), key=lambda o: -len(level1_report_dict[o]))[:panel]
+    print(f"{len(options)} experts are recruited to check options: {options}")
 
-    panel_leader = Agent()
+    panel_leader = new_agent(config, 'leader')
     debate_agents = {}
     init_critics = []
+    critic_calls = []
     
-    for i, option in enumerate(level1_report_dict.keys()):
-        debate_agent = Agent()
+    for i, option in enumerate(options):
+        debate_agent = new_agent(config, 'critic')
         query = """[Core Identity] You are an expert Critical Analyst, functioning as a Hypothesis Auditor. First check the input image, and read the question. Your task is to provide a balanced, objective, and rigorous review of a proposed hypothesis based on the provided source evidence. Your goal is to assess the overall viability and logical soundness of the hypothesis, not to attack it. You are assigned to uncover potential risks in option {OPTION} in the medical case and the supportive statements of option {OPTION} in [Historical Reports]. You should raise the risk that "why this hypothesis may be wrong", and your report would be given to a leader to make a decision. [Medical Case] {medical_case}. [Historical Reports] {latest_report}. [Output Format]#Flaws: <Describe the specific logical flaw, risk, or overlooked possibility in 3-5 CONCISE sentences.> Counter Evidence: <Cite specific evidence from the original case supporting your critique in 4 sentences.>.""".format(OPTION=option,medical_case=medical_case,latest_report=latest_report)
-        critic = debate_agent.chat(query, medical_image, 0.5)
+        critic_calls.append(Call(debate_agent, query, medical_image, config.temperature('critic', 0.5)))
+        debate_agents[f"{option}"] = debate_agent
 
-        print(f'\n[LEVEL-3][Agent{i+1}:{debate_agent.model_info}][Critics on ({option.upper()})]\n', critic)
+    # critics are independent of each other, so they are issued together
+    critics = yield Step('level-3-critic', 3, 'critic', critic_calls)
+    for i, (option, critic) in enumerate(zip(debate_agents.keys(), critics)):
+        print(f'\n[LEVEL-3][Agent{i+1}:{debate_agents[option].model_info}][Critics on ({option.upper()})]\n', critic)
         init_critics.append((option,critic))
-        debate_agents[f"{option}"] = debate_agent
 
+    # the full critiques go into the Level-3 report, the capped ones into the leader prompts
+    critics_report = "[LEVEL-3 Expert Panel Critics]\n" + "\n".join([f"Critic Expert {i+1}: {compact_text(critic[1], config.report_tokens)}" for i,critic in enumerate(init_critics)])
     init_critics = "[LEVEL-3 Expert Panel Critics]\n" + "\n".join([f"Critic Expert {i+1}: {critic[1]}" for i,critic in enumerate(init_critics)])
+    for agent in debate_agents.values():
+        token_usage = count_token_usage(token_usage, agent.get_token_usage())
+    budget.sync(token_usage, calls=len(debate_agents))
+
+    # inquiries and rebuttals cost about one call per critic plus the leader; without them the final leader judges the critiques directly
+    if not budget.allow('skip_rebuttals', len(debate_agents) + 2, panel=len(debate_agents)):
+        return (yield from level_3_verdict(medical_image, critics_report, init_critics, level1_report_dict, token_usage, config))
 
-    leader_query = """[Core Identity] You are the Lead Adjudicator, responsible for chairing an expert critical analysis of conflicting hypotheses. You are impartial, perceptive, and skilled at uncovering the truth through precise inquiry. [Task 1] First check the input image and read the question. You have just received the initial arguments on a medical case from the Critic Specialists. Your task is not to form your own opinion yet, but to act as a rigorous, impartial critic. You must critically analyze each review below, identify its single biggest weakness, logical flaw, or unsupported assumption, and formulate a targeted, challenging question for each specialist, the question should help you solve the case. [Inquiry Methodology] Strictly follow these steps in your thinking: 1.Synthesize Critiques: Comprehensively read and understand the report submitted by each Hypothesis Auditor. 2.Identify Core Conflict: What is the central point of disagreement or the most critical identified risk among the competing audits? 3.Formulate Targeted Questions: Based on this core conflict, design a challenging question for each auditor that forces them to defend their critique. [Output Format] Inquiries:@ To Expert <Expert No., e.g 1> who reviews <The option it reviews, e.g A>: <The single, most pointed question for the Expert who reviews Option, based on the risks they identified in their report.> @ To Expert <Expert No., e.g 2> who reviews <The option it reviews, e.g B>: <The single, most pointed question for the Expert who reviews Option>...(until each expert in [Critics on Assessments] is inquired, no other contents). [Medical Case] {medical_case}. [Initial Independent Assessments] {latest_report}. [Critics on Assessments] {risek_report}. Now, begin your inquiry and output strictly according to the format and requirements:""".format(medical_case=medical_case,latest_report=latest_report, risk_report=init_critics)
-    leader_consulations = panel_leader.chat(leader_query, medical_image, 0.1)
+    leader_query = """[Core Identity] You are the Lead Adjudicator, responsible for chairing an expert critical analysis of conflicting hypotheses. You are impartial, perceptive, and skilled at uncovering the truth through precise inquiry. [Task 1] First check the input image and read the question. You have just received the initial arguments on a medical case from the Critic Specialists. Your task is not to form your own opinion yet, but to act as a rigorous, impartial critic. You must critically analyze each review below, identify its single biggest weakness, logical flaw, or unsupported assumption, and formulate a targeted, challenging question for each specialist, the question should help you solve the case. [Inquiry Methodology] Strictly follow these steps in your thinking: 1.Synthesize Critiques: Comprehensively read and understand the report submitted by each Hypothesis Auditor. 2.Identify Core Conflict: What is the central point of disagreement or the most critical identified risk among the competing audits? 3.Formulate Targeted Questions: Based on this core conflict, design a challenging question for each auditor that forces them to defend their critique. [Output Format] Inquiries:@ To Expert <Expert No., e.g 1> who reviews <The option it reviews, e.g A>: <The single, most pointed question for the Expert who reviews Option, based on the risks they identified in their report.> @ To Expert <Expert No., e.g 2> who reviews <The option it reviews, e.g B>: <The single, most pointed question for the Expert who reviews Option>...(until each expert in [Critics on Assessments] is inquired, no other contents). [Medical Case] {medical_case}. [Initial Independent Assessments] {latest_report}. [Critics on Assessments] {risk_report}. Now, begin your inquiry and output strictly according to the format and requirements:""".format(medical_case=medical_case,latest_report=latest_report, risk_report=critics_report)
+    leader_consulations, = yield Step('level-3-leader', 3, 'leader', [Call(panel_leader, leader_query, medical_image, config.temperature('leader', 0.1))])
     print('\n[LEVEL-3][Leader Inquiries]\n', leader_consulations)
 
     consulations = leader_consulations.strip().split('@')[1:]
     consulations = [(extract_option(consulation.split(":")[0].split(' ')[-1]), consulation.split(":")[1].strip()) for consulation in consulations if len(consulation)>1]
     
-    rebuttals = []
-    for consul in consulations:
-        option, inquiry = consul
+    inquiries = {}
+    for option, inquiry in consulations:
         if option not in debate_agents.keys():
             continue
-        agent = debate_agents[option]
-        rebuttal_query ="""Please answer the question from the leader toward your support report in 1-3 sentences, do not change your stance:{inquiry}.""".format(inquiry=inquiry)
-        rebuttal = agent.chat(rebuttal_query, medical_image, 0.1)
-        print(f'\n[LEVEL-3][Critic for {option} - response]\n', rebuttal)
-        rebuttals.append(f'[Critic for {option} - response]\n{rebuttal}')
-        token_usage = count_token_usage(token_usage, agent.get_token_usage())
+        inquiries.setdefault(option, []).append(inquiry)
+
+    # rebuttal usage is whatever the critics spent beyond their critiques, which were charged above
+    critic_usage = {option: dict(agent.get_token_usage()) for option, agent in debate_agents.items()}
+    # each critic answers its own inquiries in order; round r asks every critic its r-th question together
+    answered = {option: [] for option in inquiries}
+    for r in range(max((len(q) for q in inquiries.values()), default=0)):
+        asked = [option for option in inquiries if r < len(inquiries[option])]
+        rebuttal_calls = []
+        for option in asked:
+            rebuttal_query ="""Please answer the question from the leader toward your support report in 1-3 sentences, do not change your stance:{inquiry}.""".format(inquiry=compact_text(inquiries[option][r], config.report_tokens))
+            rebuttal_calls.append(Call(debate_agents[option], rebuttal_query, medical_image, 0.1))
+        replies = yield Step('level-3-rebuttal', 3, 'rebuttal', rebuttal_calls)
+        for option, reply in zip(asked, replies):
+            answered[option].append(reply)
+
+    rebuttals = []
+    rebuttal_report = []
+    for option, answers in answered.items():
+        for rebuttal in answers:
+            print(f'\n[LEVEL-3][Critic for {option} - response]\n', rebuttal)
+            rebuttals.append(f'[Critic for {option} - response]\n{rebuttal}')
+            rebuttal_report.append(f'[Critic for {option} - response]\n{compact_text(rebuttal, config.report_tokens)}')
+    for option, agent in debate_agents.items():
+        usage = agent.get_token_usage()
+        token_usage = count_token_usage(token_usage, {k: usage[k] - critic_usage[option][k] for k in usage})
+    token_usage = count_token_usage(token_usage, panel_leader.get_token_usage())
 
     rebuttals = "[Expert Panel Response]\n" + '\n'.join(rebuttals)
-    level3_reports = init_critics + '[Leader Inquiries]' + leader_consulations + rebuttals
+    rebuttal_report = "[Expert Panel Response]\n" + '\n'.join(rebuttal_report)
+    discussion = init_critics + '[Panel Leader Consulations]\n' + leader_consulations + '\n' + rebuttals
+    return (yield from level_3_verdict(medical_image, rebuttal_report, discussion, level1_report_dict, token_usage, config))
 
+def level_3_verdict(medical_image, rebuttals, discussion, level1_report_dict, token_usage, config):
     leader_report_query = """[Response to your inquiries] {rebuttals} [Task 2] You have received all critiques and the final responses to your inquiries. Your task is to render the final, binding verdict on this case. Your decision must be based on which hypothesis best survived the logical stress test. [Adjudication Methodology] Strictly follow these steps in your thinking: 1. Global Review: Re-examine the complete record: the source evidence, the Critique Reports from each Critic Agent, your inquiries, and the Critics' final responses to those inquiries. 2. Compare Critique Impact: Your primary task is to compare the severity and impact of the flaws identified. Synthesize all information to determine which hypothesis, after rigorous scrutiny, best survived its dedicated critique. 3. Justify the Verdict: You must explicitly state why one hypothesis survived better than the other(s). Your final reasoning MUST be based on this direct comparison. 4. Render Final Verdict: Formulate your final, reasoned judgment, you can choose an overlooked choice when you are very confident after careful thinking. [Strict Instruction] This is the final step. No further escalation is possible. [Strict Output Format] #Final Reasoning: <A report, within 6-8 sentences, summarizing the comparative impact of the critiques. This must explain the rationale for your final verdict.> #Final Answer: <Only the single letter of your choice, e.g., A or B>.""".format(rebuttals=rebuttals)
 
-    final_leader = Agent()
-    leader_final_report = final_leader.chat(leader_report_query, medical_image, 0.1)
-        
+    final_leader = new_agent(config, 'final_leader')
+    leader_final_report, = yield Step('level-3-final', 3, 'final_leader', [Call(final_leader, leader_report_query, medical_image, config.temperature('final_leader', 0.1))])
+
     level3_option = leader_final_report.split(':')[-1].strip()
     if 'None' in leader_final_report:
         level3_option = [item for item in level1_report_dict.keys()][0]
 
-    print(f'\n[LEVEL-3][Panel Leader:{panel_leader.model_info}][Final Report]', level3_option)
+    print(f'\n[LEVEL-3][Panel Leader:{final_leader.model_info}][Final Report]', level3_option)
     print(leader_final_report)
 
-    level3_report = '[LEVEL-3 Expert Panel Discussions]\n' + init_critics + '[Panel Leader Consulations]\n' + leader_consulations + '\n' + rebuttals + '\n[Panel Leader Final Report]\n' + leader_final_report
+    level3_report = '[LEVEL-3 Expert Panel Discussions]\n' + discussion + '\n[Panel Leader Final Report]\n' + leader_final_report
 
-    token_usage = count_token_usage(token_usage, panel_leader.get_token_usage())
+    token_usage = count_token_usage(token_usage, final_leader.get_token_usage())
 
     return level3_option, level3_report, token_usage
 
-def hierachy_diagnosis(dataset, medical_case):
+def hierachy_diagnosis(dataset, medical_case, config=None, budget=None):
+    return run_steps(diagnosis_steps(dataset, medical_case, config, budget))
+
+def diagnosis_steps(dataset, medical_case, config=None, budget=None):
+    config = config or DiagnosisConfig()
+    budget = budget or CaseBudget()
     original_case = medical_case
     medical_image = medical_case['image']
     medical_case = medical_case['question']
@@ -88,7 +208,9 @@ def hierachy_diagnosis(dataset, medical_case):
     token_usage = {
             'prompt_tokens': 0,
             'completion_tokens': 0,
-            'total_tokens': 0
+            'total_tokens': 0,
+            'retry_prompt_tokens': 0,
+            'retry_completion_tokens': 0
         }
     
     # Level-1 diagnosis
@@ -98,19 +220,31 @@ def hierachy_diagnosis(dataset, medical_case):
     level1_reasoning = []
     level1_report_dict = {}
 
-    for i in range(2):
-        expert = Agent()
-        query = """[Core Identity] You are a professional and rigorous <MEDICAL FIELD> expert specializing in diagnostic imaging interpretation (<IMAGING MODALITIES>). Your core goal is to make precise, evidence-based diagnoses for the given question strictly based on the provided <IMAGING TYPE> image and medical case. [Medical Case] {medical_case}. [Reasoning Requirements] Follow these steps in your reasoning:  Follow these steps in your reasoning: 1. First check the image and read the question carefully. 2. Describe the key visual features observed in the image. 3. Explain the radiological implications of these findings. 4. Conclude which option is the best fit and clarify the rationale. [Strict Output Format] #Reasoning: <3-5 sentences of reasoning> #Answer: <a single letter of your choice, e.g. A or B.>.""".format(medical_case=medical_case)
-
-        output_response = expert.chat(query, medical_image, temperature=0.7)
-
+    query = """[Core Identity] You are a professional and rigorous <MEDICAL FIELD> expert specializing in diagnostic imaging interpretation (<IMAGING MODALITIES>). Your core goal is to make precise, evidence-based diagnoses for the given question strictly based on the provided <IMAGING TYPE> image and medical case. [Medical Case] {medical_case}. [Reasoning Requirements] Follow these steps in your reasoning:  Follow these steps in your reasoning: 1. First check the image and read the question carefully. 2. Describe the key visual features observed in the image. 3. Explain the radiological implications of these findings. 4. Conclude which option is the best fit and clarify the rationale. [Strict Output Format] #Reasoning: <3-5 sentences of reasoning> #Answer: <a single letter of your choice, e.g. A or B.>.""".format(medical_case=medical_case)
+    if config.level1_sampling:
+        # one request with n=K: prompt and image prefill are paid once for all opinions
+        sampler = new_agent(config, 'expert')
+        output_responses, = yield Step('level-1', 1, 'expert', [Call(sampler, query, medical_image, config.temperature('expert', 0.7), n=config.level1_experts)])
+        experts = [sampler] * config.level1_experts
+        confidences = sampler.confidences
+        token_usage = count_token_usage(token_usage, sampler.get_token_usage())
+        budget.sync(token_usage, calls=1)
+    else:
+        # seeds only where identical expert requests must stay apart (response cache, batch files)
+        experts = [new_agent(config, 'expert', seed=i if config.distinct_experts else None) for i in range(config.level1_experts)]
+        output_responses = yield Step('level-1', 1, 'expert', [Call(expert, query, medical_image, config.temperature('expert', 0.7)) for expert in experts])
+        for expert in experts:
+            token_usage = count_token_usage(token_usage, expert.get_token_usage())
+        budget.sync(token_usage, calls=len(experts))
+        confidences = [expert.confidences[0] if expert.confidences else None for expert in experts]
+
+    for i, (expert, output_response) in enumerate(zip(experts, output_responses)):
         print(f'\n[LEVEL-1][Agent{i+1}:{expert.model_info}]\n', output_response)
         option = extract_option(output_response.split(':')[-1])
 
         level1_responses.append(output_response)
         level1_option.append(option)
         reasoning = output_response
-        token_usage = count_token_usage(token_usage, expert.get_token_usage())
 
         level1_reasoning.append(reasoning)
         if option not in level1_report_dict.keys():
@@ -120,25 +254,48 @@ def hierachy_diagnosis(dataset, medical_case):
 
     level1_options = [item for item in level1_report_dict.items()]
 
-    level1_report = "[Level-1 Initial Assessment Reports]\n" + "\n".join([f'<Agent{i+1} #Choice: {option}#Reasoning: {level1_reasoning[i]}>' for i, option in enumerate(level1_option)])
+    level1_report = "[Level-1 Initial Assessment Reports]\n" + "\n".join([f'<Agent{i+1} #Choice: {option}#Reasoning: {compact_text(level1_reasoning[i], config.report_tokens)}>' for i, option in enumerate(level1_option)])
     latest_report = "" + level1_report
     path_flag = 0
 
+    if len(level1_options)==1 and config.level1_confidence is not None and None not in confidences and min(confidences) >= config.level1_confidence:
+        print(f'\n[LEVEL-1] Confident agreement (min p={min(confidences):.3f} >= {config.level1_confidence}), Level-2 skipped')
+        return level1_options[0][0], "level-1", token_usage
+
     if len(level1_options)==1:
-        level2_option, level2_reasoning, token_usage = level_2_diagnosis(dataset, medical_case, medical_image, level1_report, token_usage)
+        if not budget.allow('skip_level_2', 1):
+            return level1_options[0][0], "level-1", token_usage
+        level2_option, level2_reasoning, token_usage = yield from level_2_steps(dataset, medical_case, medical_image, level1_report, token_usage, config)
         latest_report = level1_report + '\n[Level-2 Extra Expert Check]\n' + '<' + level2_reasoning + '>'
 
         if len(level1_options)==1 and level2_option==level1_options[0][0]:
             return level2_option, "level-2", token_usage
+        budget.sync(token_usage, calls=1)
+        # the smallest Level-3 is two critics and the final leader
+        if not budget.allow('stop_at_level_2', 3):
+            return level2_option, "level-2", token_usage
         else:
             if level2_option in level1_report_dict.keys():
-                level2_dict[level2_option].append(level2_reasoning)
+                level1_report_dict[level2_option].append(level2_reasoning)
             else:
-                level2_dict[level2_option] = level2_reasoning
+                level1_report_dict[level2_option] = [level2_reasoning]
         path_flag = 1
+    elif not budget.allow('stop_at_level_1', 3):
+        # Level-1 disagreed but there is no budget for a panel: keep the first reported option
+        return level1_options[0][0], "level-1", token_usage
+
+    if config.report_tokens is not None:
+        # Level-3 prompts carry the report once per critic and leader, so each section is capped first
+        sections = [(f'<Agent{i+1} #Choice: {option}#Reasoning: ', level1_reasoning[i]) for i, option in enumerate(level1_option)]
+        if path_flag:
+            sections.append(('<', level2_reasoning))
+        sections, token_usage = yield from compact_report_steps(sections, token_usage, config, budget)
+        latest_report = "[Level-1 Initial Assessment Reports]\n" + "\n".join([header + text + '>' for header, text in sections[:len(level1_option)]])
+        if path_flag:
+            latest_report += '\n[Level-2 Extra Expert Check]\n' + sections[-1][0] + sections[-1][1] + '>'
 
     # Enter Level-3 diagnosis: panel debate (critc mode)
-    level3_option, level3_report, token_usage = level_3_diagnosis(medical_case, medical_image, latest_report, level1_report_dict, token_usage)
+    level3_option, level3_report, token_usage = yield from level_3_steps(medical_case, medical_image, latest_report, level1_report_dict, token_usage, config, budget)
     latest_report = latest_report + '\n' + level3_report
 
     return level3_option, ["level-3","2->3"][path_flag], token_usage
@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+
+_config = {
+    'max_entries': 64,
+    'max_side': None,   # longest image side in pixels before JPEG encoding, None keeps the original size
+    'quality': 75,
+}
+_cache = OrderedDict()  # (digest, max_side, quality) -> data url (or JPEG bytes until first use), in LRU order
+_pending = {}
+_digests = {}  # id(image) -> digest, dropped when the image is garbage collected
+_lock = threading.Lock()
+
+def configure_image_cache(max_entries=None, max_side=None, quality=None):
+    with _lock:
+        if max_entries is not None:
+            _config['max_entries'] = max(1, max_entries)
+        if max_side is not None:
+            _config['max_side'] = max_side if max_side > 0 else None
+        if quality is not None:
+            _config['quality'] = quality
+        _cache.clear()
+
+def image_settings():
+    with _lock:
+        return _config['max_side'], _config['quality']
+
+def compute_digest(image):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{image.mode}{image.size}'.encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+def _remember_digest(image, digest):
+    key = id(image)
+    with _lock:
+        if key not in _digests:
+            _digests[key] = digest
+            weakref.finalize(image, _digests.pop, key, None)
+
+def image_digest(image):
+    with _lock:
+        digest = _digests.get(id(image))
+    if digest is None:
+        digest = compute_digest(image)
+        _remember_digest(image, digest)
+    return digest
+
+def encode_jpeg(image, max_side=None, quality=75):
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def jpeg_data_url(jpeg_bytes):
+    return 'data:image/jpeg;base64,' + base64.b64encode(jpeg_bytes).decode('utf-8')
+
+def _store(key, url):
+    _cache[key] = url
+    _cache.move_to_end(key)
+    while len(_cache) > _config['max_entries']:
+        _cache.popitem(last=False)
+
+def seed_image(image, jpeg_bytes, max_side, quality, digest=None):
+    # Registers already-encoded JPEG bytes for `image`, used when they were produced with the active settings.
+    # `digest` is the image_digest of the pixels the bytes were encoded from, if already known.
+    if max_side != _config['max_side'] or quality != _config['quality']:
+        return False
+    if digest is not None:
+        _remember_digest(image, digest)
+    key = (image_digest(image), max_side, quality)
+    with _lock:
+        # base64 encoding is left to the first encode_image, on the thread that sends the request
+        _store(key, jpeg_bytes)
+    return True
+
+def _as_url(key, value):
+    # seeded entries hold JPEG bytes until first use; the data url is built outside the lock
+    if isinstance(value, str):
+        return value
+    url = jpeg_data_url(value)
+    with _lock:
+        if key in _cache:
+            _cache[key] = url
+    return url
+
+def encode_image(image):
+    # Returns the base64 JPEG data url for `image`, encoding each distinct image only once.
+    key = (image_digest(image), _config['max_side'], _config['quality'])
+    with _lock:
+        url = _cache.get(key)
+        if url is not None:
+            _cache.move_to_end(key)
+        else:
+            pending = _pending.setdefault(key, threading.Lock())
+    if url is not None:
+        return _as_url(key, url)
+
+    # concurrent agents asking for the same image wait for one encoder
+    with pending:
+        with _lock:
+            url = _cache.get(key)
+        if url is None:
+            url = jpeg_data_url(encode_jpeg(image, key[1], key[2]))
+            with _lock:
+                _store(key, url)
+                _pending.pop(key, None)
+    return _as_url(key, url)
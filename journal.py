@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+def read_journal(path):
+    records = {}
+    path = Path(path)
+    if not path.exists():
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a torn last line from a crash mid-write; that case is simply rerun
+                continue
+            records[record['case_id']] = record
+    return records
+
+class CaseJournal:
+    # Append-only JSONL record of finished cases, fsync'd per case so a crash loses at most the case in flight.
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.records = self.load() if resume else {}
+        if resume:
+            self.drop_torn_tail()
+        self.file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+
+    def load(self):
+        return read_journal(self.path)
+
+    def drop_torn_tail(self):
+        # A crash mid-write leaves a last line without its newline; the next record would be glued onto it.
+        # Cut a torn line back to the last newline, or just end a complete one.
+        if not self.path.exists():
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data or data.endswith(b'\n'):
+                return
+            start = data.rfind(b'\n') + 1
+            try:
+                json.loads(data[start:])
+            except ValueError:
+                f.truncate(start)
+            else:
+                f.write(b'\n')
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.records[record['case_id']] = record
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
@@ -1,13 +1,40 @@
 import os
+import io
 import sys
+import gzip
+import json
+import queue
 import datetime
 from pathlib import Path
 import functools
+import threading
+import contextlib
+
+CASE_LOG_FORMATS = ('none', 'jsonl', 'gzip', 'zstd')
+
+def open_case_log(path, fmt):
+    if fmt == 'gzip':
+        return gzip.open(f"{path}.gz", 'wt', encoding='utf-8')
+    if fmt == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            print("zstandard is not installed, case log falls back to gzip")
+            return open_case_log(path, 'gzip')
+        raw = open(f"{path}.zst", 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw), encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
 
 class Logger:
-    def __init__(self, log_dir='logs', log_prefix='experiment', enable_file=True, enable_console=True):
+    # print() output and per-case records are queued and written by one background thread,
+    # so cases never block on console or disk I/O.
+    def __init__(self, log_dir='logs', log_prefix='experiment', enable_file=True, enable_console=True, case_log='jsonl'):
         self.enable_file = enable_file
         self.enable_console = enable_console
+        self.queue = queue.Queue()
+        self.case_file = None
+        self.original_stdout = sys.stdout
+        self.original_stderr = sys.stderr
         
         if self.enable_file:
             self.log_dir = Path(log_dir)
@@ -17,24 +44,48 @@ class Logger:
             log_filename = f"{log_prefix}_{timestamp}.log"
             self.log_path = self.log_dir / log_filename
             
-            self.original_stdout = sys.stdout
-            self.original_stderr = sys.stderr
-            
-            self.log_file = open(self.log_path, 'w', encoding='utf-8', buffering=1)
+            self.log_file = open(self.log_path, 'w', encoding='utf-8')
+            if case_log != 'none':
+                self.case_file = open_case_log(self.log_dir / f"{log_prefix}_{timestamp}.cases.jsonl", case_log)
             
             print(f"log start, save to: {self.log_path}")
-    
-    def write(self, message):
-        if self.enable_console:
-            self.original_stdout.write(message)
-        if self.enable_file and hasattr(self, 'log_file'):
-            self.log_file.write(message)
-    
-    def flush(self):
+
+        self.writer = threading.Thread(target=self._drain, name='logger', daemon=True)
+        self.writer.start()
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, payload = item
+            if kind == 'text':
+                if self.enable_console:
+                    self.original_stdout.write(payload)
+                if self.enable_file and hasattr(self, 'log_file'):
+                    self.log_file.write(payload)
+            elif kind == 'case' and self.case_file is not None:
+                self.case_file.write(json.dumps(payload, ensure_ascii=False) + '\n')
+            # flush once the backlog is drained rather than per message
+            if self.queue.empty():
+                self._flush_files()
+
+    def _flush_files(self):
         if self.enable_console:
             self.original_stdout.flush()
         if self.enable_file and hasattr(self, 'log_file'):
             self.log_file.flush()
+        if self.case_file is not None:
+            self.case_file.flush()
+    
+    def write(self, message):
+        self.queue.put(('text', message))
+    
+    def flush(self):
+        pass
+
+    def log_case(self, record):
+        self.queue.put(('case', record))
     
     def log(self, *args, **kwargs):
         message_parts = []
@@ -51,20 +102,26 @@ class Logger:
             message = f"[{timestamp}] {message}"
         
         self.write(message)
-        self.flush()
     
     def redirect_print(self):
         if self.enable_file:
             sys.stdout = self
     
     def restore_print(self):
-        if self.enable_file and hasattr(self, 'original_stdout'):
+        if self.enable_file and sys.stdout is self:
             sys.stdout = self.original_stdout
     
     def close(self):
+        self.restore_print()
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        self._flush_files()
         if hasattr(self, 'log_file') and self.log_file:
             self.log_file.close()
-        self.restore_print()
+        if self.case_file is not None:
+            self.case_file.close()
+            self.case_file = None
     
     def __enter__(self):
         self.redirect_print()
@@ -73,8 +130,8 @@ class Logger:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
-def setup_logging(log_dir='logs', log_prefix='experiment', auto_redirect=True):
-    logger = Logger(log_dir=log_dir, log_prefix=log_prefix)
+def setup_logging(log_dir='logs', log_prefix='experiment', auto_redirect=True, case_log='jsonl'):
+    logger = Logger(log_dir=log_dir, log_prefix=log_prefix, case_log=case_log)
     
     if auto_redirect:
         logger.redirect_print()
@@ -96,11 +153,88 @@ def log_function_calls(func):
     
     return wrapper
 
+class ThreadRoutedStream:
+    # Sends writes from threads inside `case_output()` to a per-thread buffer,
+    # so concurrent cases do not interleave their transcripts.
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, message):
+        parts = getattr(self.local, 'parts', None)
+        if parts is not None:
+            parts.append(message)
+        else:
+            with self.lock:
+                self.stream.write(message)
+
+    def flush(self):
+        if getattr(self.local, 'parts', None) is None:
+            self.stream.flush()
+
+    def emit(self, text):
+        with self.lock:
+            self.stream.write(text)
+            self.stream.flush()
+
+def install_case_output():
+    if not isinstance(sys.stdout, ThreadRoutedStream):
+        sys.stdout = ThreadRoutedStream(sys.stdout)
+    return sys.stdout
+
+def uninstall_case_output():
+    if isinstance(sys.stdout, ThreadRoutedStream):
+        sys.stdout = sys.stdout.stream
+
+class CaseTranscript:
+    def __init__(self):
+        self.text = None
+
+@contextlib.contextmanager
+def case_output(emit=True):
+    # Captures everything the current thread prints; `emit=False` keeps it out of the console/log
+    # (it is still available as transcript.text, e.g. for the structured case log).
+    transcript = CaseTranscript()
+    router = sys.stdout
+    if not isinstance(router, ThreadRoutedStream):
+        yield transcript
+        return
+    router.local.parts = []
+    try:
+        yield transcript
+    finally:
+        transcript.text = ''.join(router.local.parts)
+        router.local.parts = None
+        if emit:
+            router.emit(transcript.text)
+
+@contextlib.contextmanager
+def routed_output(parts):
+    # Like case_output, but appends to a list the caller keeps, so a case advanced in several
+    # separate slices (stagewise mode) still builds up one transcript.
+    router = sys.stdout
+    if not isinstance(router, ThreadRoutedStream):
+        yield
+        return
+    previous = getattr(router.local, 'parts', None)
+    router.local.parts = parts
+    try:
+        yield
+    finally:
+        router.local.parts = previous
+
+def emit_case_output(text):
+    if isinstance(sys.stdout, ThreadRoutedStream):
+        sys.stdout.emit(text)
+    else:
+        sys.stdout.write(text)
+
 _global_logger = None
 
-def init_global_logger(log_dir='logs', log_prefix='experiment'):
+def init_global_logger(log_dir='logs', log_prefix='experiment', case_log='jsonl'):
     global _global_logger
-    _global_logger = setup_logging(log_dir=log_dir, log_prefix=log_prefix)
+    _global_logger = setup_logging(log_dir=log_dir, log_prefix=log_prefix, case_log=case_log)
     return _global_logger
 
 def get_global_logger():
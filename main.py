@@ -1,66 +1,270 @@
 import json
+import time
 import argparse
+from pathlib import Path
 from tqdm import tqdm
 from hierachy_diagnosis import hierachy_diagnosis
 from utils import check_api, extract_option, count_token_usage
 from dataset import DataLoader
-from agents import Agent
+from agents import RefusalRetryPolicy, HISTORY_POLICIES
 from datasets import load_dataset
-from logger_util import init_global_logger, cleanup_global_logger, log_function_calls
+from logger_util import init_global_logger, cleanup_global_logger, get_global_logger, log_function_calls, install_case_output, uninstall_case_output, case_output, CASE_LOG_FORMATS
+from scheduler import bounded_map, configure_fan_out
+from journal import CaseJournal, read_journal
+from prefetch import prefetch_cases
+from stagewise import StagewiseRunner, ingest_batch
+from sharding import ShardSkip, shard_suffix, shard_journal_paths
+from case_store import prepare_case_store
+from config import DiagnosisConfig
+from ratelimit import configure_limiters, limiter_stats
+from tracing import configure_tracer, get_tracer, trace_context
+from clients import configure_clients, close_clients
+from endpoints import load_endpoint_pools, configure_endpoint_pools, close_endpoint_pools, endpoint_stats
+from image_cache import configure_image_cache
+from response_cache import configure_response_cache, close_response_cache, get_response_cache, CACHE_MODES
 
-def parse_arguments():
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--dataset', type=str, default='pathvqa')
-    parser.add_argument('--unify_model', type=str, default='')
+    parser.add_argument('--unify_model', type=str, default='', help='model used by every agent unless --routing overrides it')
+    parser.add_argument('--stream', action='store_true', help='stream completions; experts, checkers and the final leader stop generating once their answer field is complete')
+    parser.add_argument('--routing', type=str, default='', help='JSON file routing each role (expert, checker, critic, leader, final_leader, summarizer) to its own model and endpoint')
+    parser.add_argument('--endpoints', type=str, default='', help='JSON file of endpoint pools (OpenAI-compatible servers with weights) to balance requests over')
+    parser.add_argument('--endpoint_routing', type=str, default='sticky', choices=['sticky', 'least_outstanding'], help='keep each agent conversation on one endpoint, or pick the least loaded endpoint per request')
+    parser.add_argument('--health_interval', type=float, default=30.0, help='seconds between endpoint health checks, 0 checks only at startup')
     parser.add_argument('--num_samples', type=int, default=-1)
     parser.add_argument('--resume', type=int, default=0)
     parser.add_argument('--checkapi', type=bool, default=False)
+    parser.add_argument('--concurrency', type=int, default=1, help='number of cases kept in flight')
+    parser.add_argument('--fan_out_workers', type=int, default=0, help='threads running the independent calls within cases, 0 sizes it from --concurrency and --max_inflight')
+    parser.add_argument('--max_connections', type=int, default=64, help='connection pool size per LLM endpoint')
+    parser.add_argument('--max_keepalive', type=int, default=32, help='idle keep-alive connections per LLM endpoint')
+    parser.add_argument('--disable_http2', action='store_true', help='force HTTP/1.1 to the LLM endpoint')
+    parser.add_argument('--image_max_side', type=int, default=0, help='downscale images whose longest side exceeds this, 0 keeps original size')
+    parser.add_argument('--jpeg_quality', type=int, default=75)
+    parser.add_argument('--prefetch_workers', type=int, default=0, help='processes decoding and encoding upcoming case images, 0 does it inline')
+    parser.add_argument('--prefetch_depth', type=int, default=16, help='cases prepared ahead of the diagnosis workers')
+    parser.add_argument('--image_cache_size', type=int, default=64, help='encoded images kept in the LRU cache')
+    parser.add_argument('--response_cache', type=str, default='off', choices=CACHE_MODES, help='LLM response cache: off, rw (read-write) or replay (cache only)')
+    parser.add_argument('--response_cache_path', type=str, default='cache/llm_responses.sqlite')
+    parser.add_argument('--case_store', type=str, default='', help='prepared case store directory to load cases from')
+    parser.add_argument('--prepare_store', action='store_true', help='build --case_store from the raw dataset and exit')
+    parser.add_argument('--level1_experts', type=int, default=2, help='number of Level-1 opinions (K)')
+    parser.add_argument('--level1_confidence', type=float, default=0, help='finish at Level-1 when all experts agree with answer-token probability at least this (uses logprobs), 0 disables')
+    parser.add_argument('--level1_sampling', action='store_true', help='draw the K Level-1 opinions from one request with n=K')
+    parser.add_argument('--history', type=str, default='full', choices=HISTORY_POLICIES, help='agent conversation history policy')
+    parser.add_argument('--case_token_budget', type=int, default=0, help='total tokens one case may spend before escalation is cut back, 0 disables')
+    parser.add_argument('--run_token_budget', type=int, default=0, help='total tokens the whole run may spend: escalation is cut back as it runs low, and once spent no new cases are started (cases in flight finish at their current level; a Level-1 disagreement keeps the first expert\'s option), 0 disables')
+    parser.add_argument('--report_tokens', type=int, default=0, help='token cap for each report section carried into Level-3 prompts, 0 keeps reports verbatim')
+    parser.add_argument('--report_summarizer', action='store_true', help='with --report_tokens, condense over-cap Level-1/Level-2 reports with a summarizer call instead of trimming')
+    parser.add_argument('--max_panel', type=int, default=0, help='most critics recruited at Level-3 (at least 2), 0 keeps one per option')
+    parser.add_argument('--rpm', type=int, default=0, help='client-side requests-per-minute budget per endpoint, 0 disables')
+    parser.add_argument('--tpm', type=int, default=0, help='client-side tokens-per-minute budget per endpoint, 0 disables')
+    parser.add_argument('--max_inflight', type=int, default=64, help='upper bound for the adaptive (AIMD) in-flight request limit per endpoint')
+    parser.add_argument('--max_retries', type=int, default=6, help='retries on 429/5xx/connection errors, with jittered exponential backoff')
+    parser.add_argument('--refusal_attempts', type=int, default=2, help='max requests per agent turn when the model refuses')
+    parser.add_argument('--refusal_temperatures', type=float, nargs='*', default=[], help='temperatures for refusal retries 1, 2, ... (last repeats); empty keeps the turn temperature')
+    parser.add_argument('--max_history_turns', type=int, default=-1, help='with --history compact, keep the first turn plus the last N turns (-1 keeps all)')
+    
+    parser.add_argument('--stagewise', action='store_true', help='run breadth-first: all cases advance stage by stage, each stage as one batch')
+    parser.add_argument('--stage_window', type=int, default=0, help='cases advanced together in --stagewise mode, 0 takes the whole dataset')
+    parser.add_argument('--batch_dir', type=str, default='', help='write every --stagewise stage as an OpenAI batch JSONL file here')
+    parser.add_argument('--batch_only', action='store_true', help='with --stagewise, never call the API; write the next uncached stage to --batch_dir and stop')
+    parser.add_argument('--ingest_batch', type=str, nargs=2, action='append', default=[], metavar=('REQUESTS', 'RESULTS'), help='load a finished batch (input and output JSONL) into the response cache before running')
+    parser.add_argument('--shard', type=int, default=0, help='index of this shard, in [0, num_shards)')
+    parser.add_argument('--num_shards', '--num-shards', type=int, default=1, help='split the dataset into this many shards by case id')
+    parser.add_argument('--merge_shards', action='store_true', help='merge shard journals into the final results file and exit')
+    parser.add_argument('--trace_dir', type=str, default='', help='record per-call spans and export them (JSONL + Chrome trace) here')
     
     parser.add_argument('--log_dir', type=str, default='logs', help='logger direction')
     parser.add_argument('--disable_logging', action='store_true', help='ban logger')
+    parser.add_argument('--verbosity', type=int, default=2, choices=[0, 1, 2], help='0: no transcripts, 1: transcripts only in the case log, 2: transcripts also on console/log file')
+    parser.add_argument('--case_log', type=str, default='jsonl', choices=CASE_LOG_FORMATS, help='structured per-case log next to the text log')
     
-    return parser.parse_args()
+    return parser
+
+def parse_arguments(argv=None):
+    return build_parser().parse_args(argv)
+
+def configure_runtime(args):
+    # process-wide client pools, caches, tracer and rate limiters shared by every case
+    configure_clients(max_connections=args.max_connections, max_keepalive_connections=args.max_keepalive, http2=not args.disable_http2)
+    configure_endpoint_pools(load_endpoint_pools(args.endpoints, sticky=args.endpoint_routing == 'sticky', health_interval=args.health_interval) if args.endpoints else {})
+    # prefetched images must stay cached until their case runs
+    cache_size = max(args.image_cache_size, args.prefetch_depth + args.concurrency) if args.prefetch_workers > 0 else args.image_cache_size
+    configure_image_cache(max_entries=cache_size, max_side=args.image_max_side, quality=args.jpeg_quality)
+    configure_response_cache(args.response_cache_path, args.response_cache)
+    configure_tracer(bool(args.trace_dir))
+    configure_fan_out(args.fan_out_workers or max(args.max_inflight, 4 * args.concurrency))
+    configure_limiters(rpm=args.rpm or None, tpm=args.tpm or None, initial_concurrency=args.max_inflight, max_concurrency=args.max_inflight, max_retries=args.max_retries)
 
 @log_function_calls
 def initialize_dataset(args):
     print(f"Loading Dataset: {args.dataset}")
+    # a case store already holds encoded images, so only dataset images are handed to the prefetch workers undecoded
+    prefetch = args.prefetch_workers > 0 and not args.case_store
+    case_set = DataLoader(dataset=args.dataset, num_samples=args.num_samples, case_store=args.case_store or None, decode_images=not prefetch)
+    print(f"Dataset Loaded Successfully, Totally {len(case_set)} Samples")
+    return case_set
+
+@log_function_calls
+def prepare_store(args):
+    print(f"Preparing case store for {args.dataset}: {args.case_store}")
     case_set = DataLoader(dataset=args.dataset, num_samples=args.num_samples)
-    test_case, gt_options = case_set.build_all_data()
-    print(f"Dataset Loaded Successfully, Totally {len(test_case)} Samples")
-    return test_case, gt_options
+    num_cases = prepare_case_store(case_set, args.case_store, max_side=args.image_max_side or None, quality=args.jpeg_quality)
+    print(f"Case store written: {num_cases} cases")
 
 @log_function_calls
-def process_single_case(no, dataset, current_case, gt_options):
+def process_single_case(dataset, current_case, gt_option, config=None):
+    no = current_case['case_id']
     print(f"\n[No.{no+1}]")
     print('[QUESTION]\n', current_case['question'])
 
-    final_option, stage_end, token_usage = hierachy_diagnosis(dataset, current_case)
+    budget = config.budget.open_case() if config and config.budget else None
+    start = time.time()
+    result = hierachy_diagnosis(dataset, current_case, config, budget)
+    return case_record(current_case, gt_option, result, time.time() - start, budget)
+
+def case_record(current_case, gt_option, result, latency, budget=None):
+    final_option, stage_end, token_usage = result
+    if budget:
+        budget.sync(token_usage)
 
-    print('\nCorrect Answer:', gt_options[no].strip().upper())
+    print('\nCorrect Answer:', gt_option.strip().upper())
     print('Predicted Answer:', final_option.strip().upper())
     
     is_correct = False
     
-    if gt_options[no].strip().upper() == extract_option(final_option):
+    if gt_option.strip().upper() == extract_option(final_option):
         is_correct = True
     
-    return is_correct, stage_end, token_usage
+    return {
+        'case_id': current_case['case_id'],
+        'gt': gt_option.strip().upper(),
+        'prediction': final_option.strip().upper(),
+        'correct': is_correct,
+        'stage_end': stage_end,
+        'token_usage': token_usage,
+        'latency': latency,
+        'decisions': budget.decisions if budget else [],
+    }
+
+def run_case(dataset, current_case, gt_option, config=None, verbosity=2):
+    with case_output(emit=verbosity >= 2) as transcript, trace_context(case_id=current_case['case_id']):
+        try:
+            record = process_single_case(dataset, current_case, gt_option, config)
+        finally:
+            print('\n' + '=' * 130 + '\n')
+    if verbosity >= 1:
+        record['transcript'] = transcript.text
+    return record
+
+def update_stats(stats, token_usage_stats, record):
+    stats['tested'] += 1
+    token_usage_stats = count_token_usage(token_usage_stats, record['token_usage'])
+    stats[record['stage_end']] += 1
+    if record.get('decisions'):
+        stats['degraded'] += 1
+    if record['correct']:
+        stats['correct'] += 1
+        stats[record['stage_end']+'_correct'] += 1
+    return stats, token_usage_stats
+
+def new_stats():
+    return {
+        'correct': 0,
+        'tested': 0,
+        'level-1': 0,
+        'level-2': 0,
+        'level-3': 0,
+        '2->3': 0,
+        'level-1_correct': 0,
+        'level-2_correct': 0,
+        'level-3_correct': 0,
+        '2->3_correct': 0,
+        'degraded': 0,
+    }
+
+def new_token_usage():
+    return {
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_tokens': 0,
+        'retry_prompt_tokens': 0,
+        'retry_completion_tokens': 0
+    }
+
+def build_results(args, stats, token_usage_stats, failed, timestamp=None, records=(), budget_stopped=False):
+    return {
+        'dataset': args.dataset,
+        'model': args.unify_model,
+        'total_samples': stats['tested'],
+        'correct_samples': stats['correct'],
+        'failed_samples': failed,
+        'token_usage': token_usage_stats,
+        'accuracy': stats['correct'] / stats['tested'] * 100 if stats['tested'] > 0 else 0,
+        'stats': stats,
+        # every case where the token budget cut escalation short, with the decisions taken
+        'degraded_cases': [{'case_id': r['case_id'], 'stage_end': r['stage_end'], 'decisions': r['decisions']} for r in records if r.get('decisions')],
+        # the run token budget ran out and the remaining cases were never started
+        'run_budget_exhausted': budget_stopped,
+        'timestamp': timestamp
+    }
+
+def write_results(results, output_filename):
+    output_dir = Path('output')
+    output_dir.mkdir(exist_ok=True)
+    output_path = output_dir / output_filename
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4, ensure_ascii=False)
+    return output_path
+
+@log_function_calls
+def merge_shards(args):
+    run_name = f"{args.dataset}_{args.unify_model}"
+    paths = shard_journal_paths('output', run_name, args.num_shards if args.num_shards > 1 else None)
+    if not paths:
+        print(f"No shard journals found for {run_name}")
+        return
+
+    records = {}
+    failed = 0
+    for path in paths:
+        shard_records = read_journal(path)
+        print(f"{path}: {len(shard_records)} cases")
+        records.update(shard_records)
+        shard_results = Path(str(path).replace('_journal.jsonl', '_results.json'))
+        if shard_results.exists():
+            with open(shard_results, 'r', encoding='utf-8') as f:
+                failed += json.load(f).get('failed_samples', 0)
+
+    stats, token_usage_stats = new_stats(), new_token_usage()
+    for record in records.values():
+        stats, token_usage_stats = update_stats(stats, token_usage_stats, record)
+    print_progress(stats['correct'], stats['tested'], stats, token_usage_stats)
+
+    output_path = write_results(build_results(args, stats, token_usage_stats, failed, records=records.values()), f"{run_name}_results.json")
+    print(f"💾 Merged {len(paths)} shards: {output_path}")
 
 def print_progress(correct, tested, stats, token_usage_stats):
     accuracy = correct / tested * 100 if tested > 0 else 0
     print(f"\n\n# Current Process: {correct}/{tested} correct ({accuracy:.1f}%) # \nLEVEL-1: {stats['level-1_correct']}/{stats['level-1']}\nLEVEL-2: {stats['level-2_correct']}/{stats['level-2']}\nLEVEL-3: {stats['level-3_correct']}/{stats['level-3']}\n2->3: {stats['2->3_correct']}/{stats['2->3']}")
     print(f"Avg Prompt Tokens Per Case: {(token_usage_stats['prompt_tokens']/((tested+1e-10)*1000)):.2f}K")
     print(f"Avg Completion Tokens Per Case: {(token_usage_stats['completion_tokens']/((tested+1e-10)*1000)):.2f}K")
+    print(f"Avg Refusal-Retry Tokens Per Case: {((token_usage_stats['retry_prompt_tokens']+token_usage_stats['retry_completion_tokens'])/((tested+1e-10)*1000)):.2f}K")
+    if stats['degraded']:
+        print(f"Budget-Degraded Cases: {stats['degraded']}/{tested}")
 
-def main():
-    args = parse_arguments()
+def main(argv=None, case_set=None):
+    # case_set: anything with iter_cases(skip_ids) and len(), e.g. benchmark.SyntheticCaseSet; defaults to --dataset
+    args = parse_arguments(argv)
     
     if not args.disable_logging:
         log_prefix = f"experiment_{args.dataset}"
         if args.unify_model:
             log_prefix += f"_{args.unify_model}"
         
-        logger = init_global_logger(log_dir=args.log_dir, log_prefix=log_prefix)
+        logger = init_global_logger(log_dir=args.log_dir, log_prefix=log_prefix, case_log=args.case_log)
         print("=" * 80)
         print("Experiment Starts")
         print(f"Time: {logger.log_path.name.split('_')[-1].replace('.log', '')}")
@@ -68,74 +272,104 @@ def main():
         print("=" * 80)
     
     try:
+        configure_runtime(args)
+        if args.prepare_store:
+            prepare_store(args)
+            return
+        if args.merge_shards:
+            merge_shards(args)
+            return
+        for requests_path, results_path in args.ingest_batch:
+            stored, rejected = ingest_batch(requests_path, results_path)
+            print(f"Ingested {results_path}: {stored} replies cached, {rejected} failed")
         if args.checkapi:
             check_api()
         
-        test_case, gt_options = initialize_dataset(args)    
-
-        stats = {
-            'correct': 0,
-            'tested': 0,
-            'level-1': 0,
-            'level-2': 0,
-            'level-3': 0,
-            '2->3': 0,
-            'level-1_correct': 0,
-            'level-2_correct': 0,
-            'level-3_correct': 0,
-            '2->3_correct': 0,
-        }
-        token_usage_stats = {
-            'prompt_tokens': 0,
-            'completion_tokens': 0,
-            'total_tokens': 0
-        }
+        if case_set is None:
+            case_set = initialize_dataset(args)
+
+        stats = new_stats()
+        token_usage_stats = new_token_usage()
 
         dataset_name = args.dataset
-        
-        for no, current_case in enumerate(tqdm(test_case, desc="processing")):
-            print_progress(stats['correct'], stats['tested'], stats, token_usage_stats)
-            stats['tested'] += 1
-            
-            try:
-                is_correct, stage_end, token_usage = process_single_case(no, dataset_name, current_case, gt_options)
-                token_usage_stats = count_token_usage(token_usage_stats, token_usage)
-                stats[stage_end] += 1
-                if is_correct:
-                    stats['correct'] += 1
-                    stats[stage_end+'_correct'] += 1
-                    
-            except Exception as e:
-                print(f"❌ Error: {e}")
+        config = DiagnosisConfig.from_args(args)
+        run_name = f"{args.dataset}_{args.unify_model}{shard_suffix(args.shard, args.num_shards)}"
+        journal = CaseJournal(Path('output') / f"{run_name}_journal.jsonl", resume=bool(args.resume))
+        for record in journal.records.values():
+            stats, token_usage_stats = update_stats(stats, token_usage_stats, record)
+        # resumed spend counts against the run budget too
+        config.budget.charge(token_usage_stats['total_tokens'])
+        if journal.records:
+            print(f"Resumed {len(journal.records)} finished cases from {journal.path}")
+
+        # every case's output is captured and emitted as one block (or dropped, depending on --verbosity)
+        install_case_output()
+
+        failed = 0
+        remaining = case_set.iter_cases(skip_ids=ShardSkip(journal.records, args.shard, args.num_shards))
+        if args.prefetch_workers > 0 and not args.case_store:
+            remaining = prefetch_cases(remaining, args.prefetch_workers, args.prefetch_depth)
+        remaining = config.budget.admit(remaining)
+        runner = None
+        if args.stagewise:
+            if args.run_token_budget and args.stage_window <= 0:
+                # a window is read in full before any of it spends tokens, so the budget needs several windows to stop at
+                raise ValueError('--run_token_budget with --stagewise needs a --stage_window')
+            if args.batch_only and args.response_cache != 'rw':
+                raise ValueError('--batch_only needs --response_cache rw to pick up ingested replies')
+            if args.batch_only:
+                # a refusal retry would be a live request, so batch-only runs take the first reply as is
+                config.retry_policy = RefusalRetryPolicy(max_attempts=1)
+            runner = StagewiseRunner(dataset_name, config, case_record, concurrency=args.max_inflight, window=args.stage_window,
+                                     batch_dir=args.batch_dir or (str(Path('output') / 'batches') if args.batch_only else None),
+                                     batch_only=args.batch_only, run_name=run_name, verbosity=args.verbosity)
+            jobs = runner.run(remaining)
+        else:
+            jobs = bounded_map(lambda job: run_case(dataset_name, job[0], job[1], config, args.verbosity), remaining, args.concurrency)
+        print_progress(stats['correct'], stats['tested'], stats, token_usage_stats)
+        for (current_case, gt_option), record, error in tqdm(jobs, total=max(len(case_set) // max(args.num_shards, 1) - len(journal.records), 0), desc="processing"):
+            if error is not None:
+                print(f"❌ Error: {error}")
                 print('[!!Error!!] Something went wrong. Continue. Samples -1.')
-                stats['tested'] -= 1
+                failed += 1
                 continue
-                
-            print('\n' + '=' * 130 + '\n')
+
+            transcript = record.pop('transcript', None)
+            journal.append(record)
+            if get_global_logger() is not None:
+                get_global_logger().log_case(dict(record, transcript=transcript) if transcript is not None else record)
+            stats, token_usage_stats = update_stats(stats, token_usage_stats, record)
+            print_progress(stats['correct'], stats['tested'], stats, token_usage_stats)
+
+        uninstall_case_output()
+        journal.close()
+        if runner is not None and runner.pending_batch is not None:
+            print(f"⏸ Waiting on batch {runner.pending_batch}: submit it, then rerun with --ingest_batch {runner.pending_batch} <results.jsonl>")
         
         final_accuracy = stats['correct'] / stats['tested'] * 100 if stats['tested'] > 0 else 0
         print("\n" + "=" * 80)
         print("Experiment Finished!")
         print(f"Final Accuracy: {final_accuracy:.2f}% - {stats['correct']}/{stats['tested']} correct.")
+        if failed:
+            print(f"⚠️ {failed} cases failed after retries and are not counted.")
+        if config.budget.stopped:
+            print(f"⚠️ Run token budget spent: {len(case_set) // max(args.num_shards, 1) - stats['tested'] - failed} cases were not started.")
+        if get_tracer() is not None:
+            trace_prefix = Path(args.trace_dir) / run_name
+            get_tracer().export_jsonl(f"{trace_prefix}_spans.jsonl")
+            get_tracer().export_chrome(f"{trace_prefix}_trace.json")
+            print(get_tracer().format_summary())
+            print(f"Traces Saved: {trace_prefix}_spans.jsonl, {trace_prefix}_trace.json")
+        if get_response_cache() is not None:
+            print(f"Response Cache: {get_response_cache().hits} hits, {get_response_cache().misses} misses")
+        for pool_name, endpoints in endpoint_stats().items():
+            print(f"Endpoint Pool {pool_name}: " + ', '.join(f"{e['base_url']} {e['requests']} requests{'' if e['healthy'] else ' (down)'}" for e in endpoints))
+        for endpoint, limits in limiter_stats().items():
+            print(f"Rate Limiter {endpoint}: {limits['throttled']} throttled retries, {limits['backoff']:.1f}s backoff, concurrency limit {limits['concurrency_limit']}")
         print("=" * 80)
         
-        results = {
-            'dataset': args.dataset,
-            'model': args.unify_model,
-            'total_samples': stats['tested'],
-            'correct_samples': stats['correct'],
-            'accuracy': final_accuracy,
-            'timestamp': logger.log_path.name if not args.disable_logging else None
-        }
-        
-        output_dir = Path('output')
-        output_dir.mkdir(exist_ok=True)
-        
-        output_filename = f"{args.dataset}_{args.unify_model}_results.json"
-        output_path = output_dir / output_filename
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=4, ensure_ascii=False)
+        results = build_results(args, stats, token_usage_stats, failed, logger.log_path.name if not args.disable_logging else None, journal.records.values(), config.budget.stopped)
+        output_path = write_results(results, f"{run_name}_results.json")
         
         print(f"💾 Logger Saved: {output_path}")
         
@@ -144,6 +378,10 @@ def main():
     except Exception as e:
         print(f" Error: {e}")
     finally:
+        uninstall_case_output()
+        close_endpoint_pools()
+        close_clients()
+        close_response_cache()
         if not args.disable_logging:
             cleanup_global_logger()
             print("📝 Logger Saved and Closed")
@@ -0,0 +1,149 @@
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from ratelimit import estimate_tokens
+
+# In-process stand-in for an OpenAI-compatible chat-completions client. It answers every prompt of the
+# diagnosis hierarchy in the format the parsers expect, with configurable latency, refusals and errors.
+
+class MockAPIError(Exception):
+    def __init__(self, status_code, message=''):
+        super().__init__(message or f'mock error {status_code}')
+        self.status_code = status_code
+        self.response = None
+
+def make_latency_sampler(distribution='lognormal', mean=0.5, spread=0.5):
+    if distribution == 'fixed':
+        return lambda: mean
+    if distribution == 'uniform':
+        return lambda: random.uniform(max(0.0, mean - spread), mean + spread)
+    if distribution == 'lognormal':
+        if mean <= 0:
+            return lambda: 0.0
+        # lognormal with the requested mean; `spread` is the sigma of the underlying normal
+        mu = math.log(mean) - spread ** 2 / 2
+        return lambda: random.lognormvariate(mu, spread)
+    raise ValueError(f'Unknown latency distribution: {distribution}')
+
+def _last_user_text(messages):
+    for message in reversed(messages):
+        if message['role'] != 'user':
+            continue
+        content = message['content']
+        if isinstance(content, str):
+            return content
+        return ' '.join(part.get('text', '') for part in content if part.get('type') == 'text')
+    return ''
+
+def canned_reply(prompt, rng=random):
+    options = sorted(set(re.findall(r'\(([A-E])\)', prompt))) or ['A', 'B']
+    choice = rng.choice(options)
+    if 'Task 2' in prompt or '#Final Answer' in prompt:
+        return f'#Final Reasoning: The critique of the alternative option was more severe. #Final Answer: {choice}'
+    if 'Lead Adjudicator' in prompt:
+        return 'Inquiries:' + ''.join(f'@ To Expert {i+1} who reviews {o}: What image feature contradicts option {o}? ' for i, o in enumerate(options))
+    if 'Hypothesis Auditor' in prompt:
+        return '#Flaws: The hypothesis overlooks an alternative reading of the image. Counter Evidence: The staining pattern is ambiguous.'
+    if 'answer the question from the leader' in prompt:
+        return 'The observed morphology still supports my critique.'
+    if 'Review Reasoning' in prompt:
+        return f'#Review Reasoning: The prior reports are consistent with the image findings. #Answer: {choice}'
+    return f'#Reasoning: The image shows features consistent with this option. #Answer: {choice}'
+
+def mock_logprobs(text, confidence, chunk_chars=4):
+    # Fixed-width "tokens"; the one carrying the answer letter gets log(confidence), the rest are near-certain.
+    match = list(re.finditer(r'Answer\s*:\s*([A-Z])', text))
+    position = match[-1].start(1) if match else -1
+    tokens = []
+    for i in range(0, len(text), chunk_chars):
+        logprob = math.log(confidence) if i <= position < i + chunk_chars else -0.01
+        tokens.append(SimpleNamespace(token=text[i:i + chunk_chars], logprob=logprob))
+    return tokens
+
+class MockStream:
+    # Iterates chat.completion.chunk-like objects a few characters at a time; close() ends generation early.
+    def __init__(self, backend, contents, usage, include_usage=False, chunk_chars=4, logprobs=None):
+        self.backend = backend
+        self.contents = contents
+        self.usage = usage
+        self.include_usage = include_usage
+        self.chunk_chars = chunk_chars
+        self.logprobs = logprobs
+        self.closed = False
+
+    def __iter__(self):
+        text = self.contents[0] if self.contents else ''
+        for i in range(0, len(text), self.chunk_chars):
+            if self.closed:
+                return
+            time.sleep(self.backend.token_latency)
+            delta = SimpleNamespace(role='assistant', content=text[i:i + self.chunk_chars])
+            logprobs = SimpleNamespace(content=[self.logprobs[i // self.chunk_chars]]) if self.logprobs else None
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta, logprobs=logprobs, finish_reason=None)], usage=None)
+        if self.include_usage:
+            yield SimpleNamespace(choices=[], usage=self.usage)
+
+    def close(self):
+        self.closed = True
+
+class MockCompletions:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create(self, model=None, messages=None, temperature=0.0, n=1, stream=False, stream_options=None, **kwargs):
+        backend = self.backend
+        backend.count_call()
+        time.sleep(backend.latency())
+        if random.random() < backend.error_rate:
+            raise MockAPIError(random.choice(backend.error_codes))
+
+        prompt = _last_user_text(messages)
+        contents = []
+        for _ in range(n if backend.honour_n else 1):
+            if random.random() < backend.refusal_rate:
+                contents.append("I'm sorry, I cannot help with that.")
+            else:
+                contents.append(canned_reply(prompt) + backend.trailing_text)
+
+        prompt_tokens = estimate_tokens(messages)
+        completion_tokens = sum(len(c) // 4 for c in contents)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+        logprobs = [mock_logprobs(c, backend.answer_confidence()) for c in contents] if kwargs.get('logprobs') else [None] * len(contents)
+        if stream:
+            return MockStream(backend, contents, usage, include_usage=bool(stream_options and stream_options.get('include_usage')), logprobs=logprobs[0] if contents else None)
+        # a non-streamed reply still takes as long to generate as its longest choice
+        time.sleep(backend.token_latency * max((len(c) + 3) // 4 for c in contents))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(index=i, message=SimpleNamespace(role='assistant', content=c), logprobs=SimpleNamespace(content=lp) if lp else None, finish_reason='stop') for i, (c, lp) in enumerate(zip(contents, logprobs))],
+            usage=usage,
+        )
+
+class MockClient:
+    def __init__(self, latency=None, refusal_rate=0.0, error_rate=0.0, error_codes=(429, 500, 503), honour_n=True, token_latency=0.0, trailing_text='', confidence=(0.5, 1.0)):
+        self.latency = latency or make_latency_sampler('fixed', 0.0)
+        self.refusal_rate = refusal_rate
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.honour_n = honour_n
+        # per streamed chunk delay, and text models keep generating after the answer field
+        self.token_latency = token_latency
+        self.trailing_text = trailing_text
+        # range the answer-letter probability is drawn from when logprobs are requested
+        self.confidence = confidence
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=MockCompletions(self))
+        self.models = SimpleNamespace(list=lambda **kwargs: SimpleNamespace(data=[SimpleNamespace(id='mock-model')]))
+
+    def answer_confidence(self):
+        return random.uniform(*self.confidence)
+
+    def count_call(self):
+        with self.lock:
+            self.calls += 1
+
+    def close(self):
+        pass
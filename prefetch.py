@@ -0,0 +1,51 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image
+from image_cache import compute_digest, encode_jpeg, image_settings, seed_image
+
+# Moves image decode, RGB conversion, resizing and JPEG encoding off the diagnosis process. Up to `depth`
+# cases ahead of the consumer are prepared in a process pool; each comes back as JPEG bytes plus the digest
+# of its pixels, which are seeded into image_cache, so agents find the request payload already encoded and
+# the main process never decodes the image. Memory is capped by `depth` encoded images.
+
+def _prepare(raw, max_side, quality):
+    # raw: encoded image file bytes (DataLoader with decode_images=False) or a PIL image
+    image = Image.open(BytesIO(raw)) if isinstance(raw, (bytes, bytearray)) else raw
+    image = image.convert('RGB')
+    return encode_jpeg(image, max_side, quality), compute_digest(image)
+
+def prefetch_cases(cases, workers=4, depth=16):
+    # Wraps an iterator of (case, gt_option) and yields the same pairs in order, with case['image']
+    # replaced by a lazily decoded JPEG whose request payload is already in the image cache.
+    max_side, quality = image_settings()
+    # spawn keeps the workers independent of the threads (logger, client pools) already running here
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    pending = deque()
+    cases = iter(cases)
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < depth:
+                try:
+                    current_case, gt_option = next(cases)
+                except StopIteration:
+                    exhausted = True
+                    break
+                raw = current_case.get('image')
+                future = pool.submit(_prepare, raw, max_side, quality) if raw is not None else None
+                pending.append((current_case, gt_option, future))
+
+            if not pending:
+                break
+
+            current_case, gt_option, future = pending.popleft()
+            if future is not None:
+                jpeg_bytes, digest = future.result()
+                image = Image.open(BytesIO(jpeg_bytes))
+                seed_image(image, jpeg_bytes, max_side, quality, digest)
+                current_case = dict(current_case, image=image)
+            yield current_case, gt_option
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+import openai
+
+class TokenBucket:
+    # Refills `rate_per_min` units per minute up to `capacity`; acquire() blocks until enough units are available.
+    def __init__(self, rate_per_min, capacity=None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        # requests larger than the bucket are clamped, otherwise they could never be served
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        # settles the difference between the estimated and the actual cost; the balance may go negative
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+class AdaptiveConcurrency:
+    # AIMD limit on in-flight requests: +1 after a full window of successes, halved on throttling.
+    def __init__(self, initial=64, minimum=1, maximum=256):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        start = time.monotonic()
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= int(self.limit):
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+            self.cond.notify_all()
+
+def is_retryable(error):
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError))
+
+def is_connection_error(error):
+    # the server could not be reached at all, as opposed to answering with an error status
+    return getattr(error, 'status_code', None) is None and is_retryable(error)
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def estimate_tokens(messages):
+    # rough pre-request estimate for the TPM bucket: ~4 characters per token, fixed cost per image
+    total = 0
+    for message in messages:
+        content = message['content']
+        if isinstance(content, str):
+            total += len(content) // 4
+            continue
+        for part in content:
+            if part.get('type') == 'image_url':
+                total += 765
+            else:
+                total += len(part.get('text', '')) // 4
+    return total
+
+class EndpointLimiter:
+    def __init__(self, rpm=None, tpm=None, initial_concurrency=64, min_concurrency=1, max_concurrency=256, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        # requests retried after throttling, a 5xx or a connection error, and the seconds spent backing off
+        self.throttled = 0
+        self.backoff = 0.0
+
+    def call(self, fn, estimated_tokens=0, token_count=None, info=None, retry_connection=True):
+        # Runs fn() under the endpoint's budgets, retrying throttling/5xx/connection errors with
+        # exponentially growing, fully jittered delays. `info` (a dict) receives queue wait, retries and
+        # backoff seconds. retry_connection=False raises connection errors at once, for callers that can fail over elsewhere.
+        queue_wait = 0.0
+        backoff = 0.0
+        attempt = 0
+        while True:
+            if self.requests is not None:
+                queue_wait += self.requests.acquire(1)
+            if self.tokens is not None:
+                queue_wait += self.tokens.acquire(estimated_tokens)
+            queue_wait += self.concurrency.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = is_retryable(e)
+                self.concurrency.release(throttled=retryable)
+                if not retryable or attempt >= self.max_retries or (not retry_connection and is_connection_error(e)):
+                    raise
+                delay = max(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)), retry_after(e))
+                with self.lock:
+                    self.throttled += 1
+                    self.backoff += delay
+                time.sleep(delay)
+                backoff += delay
+                attempt += 1
+                continue
+
+            self.concurrency.release()
+            if self.tokens is not None and token_count is not None:
+                actual = token_count(result)
+                if actual is not None:
+                    self.tokens.adjust(actual - estimated_tokens)
+            if info is not None:
+                info['queue_wait'] = queue_wait
+                info['retries'] = attempt
+                info['backoff'] = backoff
+            return result
+
+    def stats(self):
+        with self.lock:
+            return {'throttled': self.throttled, 'backoff': self.backoff, 'concurrency_limit': int(self.concurrency.limit)}
+
+_limiter_config = {}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def configure_limiters(**kwargs):
+    with _limiters_lock:
+        _limiter_config.clear()
+        _limiter_config.update(kwargs)
+        _limiters.clear()
+
+def get_limiter(endpoint):
+    # one limiter per endpoint, shared by every agent talking to it
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            limiter = EndpointLimiter(**_limiter_config)
+            _limiters[endpoint] = limiter
+    return limiter
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {endpoint: limiter.stats() for endpoint, limiter in limiters.items()}
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_MODES = ('off', 'rw', 'replay')
+
+class CacheMiss(Exception):
+    pass
+
+def _canonical_messages(messages):
+    # Image payloads are replaced by their digest so keys stay small and independent of base64 layout.
+    canonical = []
+    for message in messages:
+        content = message['content']
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                if part.get('type') == 'image_url':
+                    url = part['image_url']['url']
+                    part = {'type': 'image_url', 'digest': hashlib.sha256(url.encode('utf-8')).hexdigest()}
+                parts.append(part)
+            content = parts
+        canonical.append({'role': message['role'], 'content': content})
+    return canonical
+
+class ResponseCache:
+    def __init__(self, path, mode='rw'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f'Unknown response cache mode: {mode}')
+        self.mode = mode
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            content TEXT,
+            usage TEXT,
+            created REAL,
+            confidences TEXT
+        )""")
+        # caches written before answer confidences were stored lack the column
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(responses)')}
+        if 'confidences' not in columns:
+            self.conn.execute('ALTER TABLE responses ADD COLUMN confidences TEXT')
+        self.conn.commit()
+
+    def make_key(self, model, messages, temperature, attempt=0, **extra):
+        payload = {
+            'model': model,
+            'messages': _canonical_messages(messages),
+            'temperature': temperature,
+            'attempt': attempt,
+            'extra': extra,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def request_key(self, request, attempt=0):
+        # key for a chat-completions request body as built by Agent._request_body
+        extra = {k: request[k] for k in ('n', 'max_tokens', 'logprobs', 'seed') if request.get(k) is not None}
+        return self.make_key(request['model'], request['messages'], request['temperature'], attempt, **extra)
+
+    def contains(self, key):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM responses WHERE key = ?', (key,)).fetchone() is not None
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT content, usage, confidences FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            if self.mode == 'replay':
+                raise CacheMiss(f'No cached response for key {key} in replay-only mode')
+            return None
+        return {'content': row[0], 'usage': json.loads(row[1]) if row[1] else None, 'confidences': json.loads(row[2]) if row[2] else None}
+
+    def put(self, key, model, content, usage, confidences=None):
+        if self.mode != 'rw':
+            return
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, model, content, usage, created, confidences) VALUES (?, ?, ?, ?, ?, ?)',
+                              (key, model, content, json.dumps(usage) if usage else None, time.time(), json.dumps(confidences) if confidences else None))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_response_cache = None
+
+def configure_response_cache(path, mode='rw'):
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = None if mode == 'off' else ResponseCache(path, mode)
+    return _response_cache
+
+def get_response_cache():
+    return _response_cache
+
+def close_response_cache():
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+        _response_cache = None
@@ -0,0 +1,68 @@
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def bounded_map(fn, items, concurrency=1):
+    # Yields (item, result, error) as items finish, with at most `concurrency` items in flight.
+    # Items are pulled from `items` lazily, so generators are never materialized.
+    if concurrency <= 1:
+        for item in items:
+            try:
+                yield item, fn(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    pending = {}
+    items = iter(items)
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(fn, item)] = item
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, (None if error else future.result()), error
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+_fan_out_pool = None
+_fan_out_workers = 32
+_fan_out_lock = threading.Lock()
+
+def configure_fan_out(workers):
+    # every case in flight fans out its Level-1 experts and critics here, so the pool must cover
+    # concurrency x fan-out width or calls queue behind each other below the request limits
+    global _fan_out_pool, _fan_out_workers
+    with _fan_out_lock:
+        _fan_out_workers = max(1, workers)
+        if _fan_out_pool is not None:
+            _fan_out_pool.shutdown(wait=False)
+            _fan_out_pool = None
+
+def fan_out(calls):
+    # Runs independent zero-argument callables concurrently and returns their results in order.
+    # Uses its own pool so cases running inside `bounded_map` never wait on their own workers.
+    global _fan_out_pool
+    calls = list(calls)
+    if len(calls) <= 1 or _fan_out_workers <= 1:
+        return [call() for call in calls]
+    with _fan_out_lock:
+        if _fan_out_pool is None:
+            _fan_out_pool = ThreadPoolExecutor(max_workers=_fan_out_workers, thread_name_prefix='fan_out')
+        pool = _fan_out_pool
+    # each call runs in a copy of the caller's context so trace tags (case, level, role) follow it
+    futures = [pool.submit(contextvars.copy_context().run, call) for call in calls]
+    return [future.result() for future in futures]
@@ -0,0 +1,257 @@
+import base64
+import itertools
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from PIL import Image
+from hierachy_diagnosis import hierachy_diagnosis
+from config import DiagnosisConfig
+from logger_util import init_global_logger, cleanup_global_logger, get_global_logger, install_case_output, uninstall_case_output, case_output
+from tracing import configure_tracer, get_tracer, trace_context
+from clients import close_clients
+from endpoints import close_endpoint_pools, endpoint_stats
+from response_cache import close_response_cache
+from ratelimit import limiter_stats
+import main as ucagents_main
+
+# Resident diagnosis service. Clients, caches and the tracer stay warm across requests:
+#   python service.py --port 8000 --unify_model qwen2.5vl:7b --concurrency 8
+#   curl -X POST localhost:8000/diagnose -d '{"question": "Is there a tumor?", "options": ["yes", "no"], "image": "<base64>"}'
+#   curl localhost:8000/stats
+
+OPTION_LETTERS = 'ABCDEFGHIJ'
+
+class FairQueue:
+    # Round-robin over clients and FIFO within each client, so one client's burst cannot starve the others.
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self.queues = OrderedDict()
+        self.size = 0
+        self.cond = threading.Condition()
+
+    def put(self, client, item):
+        with self.cond:
+            if self.max_size and self.size >= self.max_size:
+                raise queue.Full
+            self.queues.setdefault(client, deque()).append(item)
+            self.size += 1
+            self.cond.notify()
+
+    def get(self):
+        with self.cond:
+            while self.size == 0:
+                self.cond.wait()
+            client, items = next(iter(self.queues.items()))
+            item = items.popleft()
+            # the served client moves to the back of the rotation
+            del self.queues[client]
+            if items:
+                self.queues[client] = items
+            self.size -= 1
+            return item
+
+    def depth(self):
+        with self.cond:
+            return self.size, {client: len(items) for client, items in self.queues.items()}
+
+def build_question(payload):
+    # Either a ready question (with its own "Options:" line) or a question plus a list of options.
+    question = payload['question']
+    options = payload.get('options')
+    if not options:
+        return question
+    if len(options) > len(OPTION_LETTERS):
+        raise ValueError(f'At most {len(OPTION_LETTERS)} options are supported')
+    return 'Case: ' + question + '\nOptions:' + ' '.join(f'\n({OPTION_LETTERS[i]}){option}' for i, option in enumerate(options))
+
+def decode_image(payload):
+    data = payload.get('image')
+    if not data:
+        return None
+    image = Image.open(BytesIO(base64.b64decode(data)))
+    return image.convert('RGB')
+
+class DiagnosisService:
+    def __init__(self, config, workers=4, max_queue=0, verbosity=0):
+        self.config = config
+        self.verbosity = verbosity
+        self.queue = FairQueue(max_queue)
+        self.case_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.started = time.time()
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, payload, client='default'):
+        # Returns a Future resolved with the result dict; raises queue.Full when the queue is at capacity.
+        current_case = {'question': build_question(payload), 'image': decode_image(payload), 'case_id': next(self.case_ids)}
+        future = Future()
+        self.queue.put(client, (current_case, payload, future, time.time()))
+        return future
+
+    def work(self):
+        while True:
+            current_case, payload, future, queued = self.queue.get()
+            with self.lock:
+                self.in_flight += 1
+            try:
+                result = self.diagnose(current_case, payload, time.time() - queued)
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                future.set_exception(e)
+            else:
+                with self.lock:
+                    self.completed += 1
+                future.set_result(result)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+    def diagnose(self, current_case, payload, queue_wait):
+        case_id = current_case['case_id']
+        budget = self.config.budget.open_case() if self.config.budget else None
+        start = time.time()
+        try:
+            with case_output(emit=self.verbosity >= 2) as transcript, trace_context(case_id=case_id):
+                option, stage_end, token_usage = hierachy_diagnosis('service', current_case, self.config, budget)
+        finally:
+            # spans are handed to the caller, not kept for the life of the service
+            trace = get_tracer().take(case_id) if get_tracer() is not None else []
+        if budget:
+            budget.sync(token_usage)
+        result = {
+            'case_id': case_id,
+            'verdict': option.strip().upper(),
+            'stage_end': stage_end,
+            'token_usage': token_usage,
+            'decisions': budget.decisions if budget else [],
+            'latency': time.time() - start,
+            'queue_wait': queue_wait,
+            'trace': trace,
+        }
+        if get_global_logger() is not None:
+            get_global_logger().log_case(dict(result, transcript=transcript.text) if self.verbosity >= 1 else result)
+        if payload.get('transcript'):
+            result['transcript'] = transcript.text
+        return result
+
+    def stats(self):
+        depth, by_client = self.queue.depth()
+        with self.lock:
+            return {
+                'queue_depth': depth,
+                'queued_by_client': by_client,
+                'in_flight': self.in_flight,
+                'workers': len(self.workers),
+                'completed': self.completed,
+                'failed': self.failed,
+                'uptime': time.time() - self.started,
+                'endpoints': endpoint_stats(),
+                'rate_limits': limiter_stats(),
+            }
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def address_string(self):
+        # Unix-socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.service.stats())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': f'Unknown path: {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/diagnose':
+            self.send_json(404, {'error': f'Unknown path: {self.path}'})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            client = payload.get('client') or self.headers.get('X-Client-Id') or self.address_string()
+            future = self.service.submit(payload, client)
+        except queue.Full:
+            self.send_json(503, {'error': 'Queue is full', **self.service.stats()})
+            return
+        except (KeyError, ValueError, OSError) as e:
+            self.send_json(400, {'error': f'Bad request: {e}'})
+            return
+        try:
+            self.send_json(200, future.result())
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = 'unix', 0
+
+def parse_arguments(argv=None):
+    parser = ucagents_main.build_parser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix_socket', type=str, default='', help='listen on this Unix socket instead of host:port')
+    parser.add_argument('--max_queue', type=int, default=0, help='queued cases before new requests get 503, 0 is unbounded')
+    return parser.parse_args(argv)
+
+def serve(argv=None):
+    args = parse_arguments(argv)
+    if not args.disable_logging:
+        init_global_logger(log_dir=args.log_dir, log_prefix='service', case_log=args.case_log)
+    ucagents_main.configure_runtime(args)
+    # spans are returned with every verdict, so tracing is always on
+    configure_tracer(True)
+    install_case_output()
+
+    # --concurrency is the number of cases diagnosed at once
+    service = DiagnosisService(DiagnosisConfig.from_args(args), workers=max(args.concurrency, 1), max_queue=args.max_queue, verbosity=args.verbosity)
+    handler = type('Handler', (ServiceHandler,), {'service': service})
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = UnixHTTPServer(args.unix_socket, handler)
+        print(f'UCAgents service listening on {args.unix_socket}')
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        print(f'UCAgents service listening on http://{args.host}:{args.port}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\n user interrupt')
+    finally:
+        server.server_close()
+        uninstall_case_output()
+        close_endpoint_pools()
+        close_clients()
+        close_response_cache()
+        if not args.disable_logging:
+            cleanup_global_logger()
+
+if __name__ == '__main__':
+    serve()
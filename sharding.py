@@ -0,0 +1,24 @@
+from pathlib import Path
+
+# Cases are assigned to shards by their stable case_id (the row index in the original split),
+# so the partition does not depend on --shuffle, --num_samples or the machine running it.
+
+def in_shard(case_id, shard=0, num_shards=1):
+    return num_shards <= 1 or case_id % num_shards == shard
+
+def shard_suffix(shard=0, num_shards=1):
+    return '' if num_shards <= 1 else f'_shard{shard}of{num_shards}'
+
+class ShardSkip:
+    # Drop-in for DataLoader.iter_cases(skip_ids=...): skips finished cases and cases owned by other shards.
+    def __init__(self, done, shard=0, num_shards=1):
+        self.done = done
+        self.shard = shard
+        self.num_shards = num_shards
+
+    def __contains__(self, case_id):
+        return case_id in self.done or not in_shard(case_id, self.shard, self.num_shards)
+
+def shard_journal_paths(output_dir, run_name, num_shards=None):
+    pattern = f'{run_name}_shard*of{num_shards or "*"}_journal.jsonl'
+    return sorted(Path(output_dir).glob(pattern))
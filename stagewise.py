@@ -0,0 +1,213 @@
+import itertools
+import json
+import time
+from pathlib import Path
+from agents import answer_confidence, logprob_tokens
+from hierachy_diagnosis import STAGES, diagnosis_steps
+from logger_util import routed_output, emit_case_output
+from response_cache import get_response_cache
+from scheduler import bounded_map
+from tracing import trace_context
+
+# Breadth-first execution. Instead of taking each case through the hierarchy on its own, a window of cases
+# is advanced in lockstep and all calls of one stage go out together as one large uniform batch: every
+# Level-1 expert, then every Level-2 check, then the Level-3 critics, leaders, rebuttals and verdicts.
+#
+# With batch_dir set, each stage is also written out as an OpenAI batch input file. With batch_only, requests
+# are never sent: a stage runs only once all its replies are in the response cache, otherwise its missing
+# requests are written and the run stops. Submit the file, load the output with ingest_batch and rerun;
+# earlier stages replay from the cache and the next stage is written.
+
+BATCH_URL = '/v1/chat/completions'
+
+def windows(items, size):
+    items = iter(items)
+    while True:
+        window = list(itertools.islice(items, size)) if size > 0 else list(items)
+        if not window:
+            return
+        yield window
+        if size <= 0:
+            return
+
+class CaseRun:
+    def __init__(self, current_case, gt_option, steps, budget=None):
+        self.current_case = current_case
+        self.gt_option = gt_option
+        self.steps = steps
+        self.budget = budget
+        self.parts = []
+        self.step = None
+        self.result = None
+        self.error = None
+        self.start = time.time()
+
+    def advance(self, replies=None):
+        # runs the case's own code up to its next Step, with its prints going to its transcript
+        with routed_output(self.parts):
+            try:
+                self.step = self.steps.send(replies)
+            except StopIteration as stop:
+                self.step = None
+                self.result = stop.value
+            except Exception as e:
+                self.step = None
+                self.error = e
+
+class StagewiseRunner:
+    def __init__(self, dataset, config, finish, concurrency=64, window=0, batch_dir=None, batch_only=False, run_name='stagewise', verbosity=2):
+        self.dataset = dataset
+        self.config = config
+        # finish(current_case, gt_option, (option, stage_end, token_usage), latency, budget) -> record
+        self.finish = finish
+        self.concurrency = concurrency
+        self.window = window
+        self.batch_dir = batch_dir
+        self.batch_only = batch_only
+        self.run_name = run_name
+        self.verbosity = verbosity
+        self.batches = 0
+        # set when batch_only stops at a stage whose replies are not in the cache yet
+        self.pending_batch = None
+
+    def start(self, current_case, gt_option):
+        budget = self.config.budget.open_case() if self.config.budget else None
+        run = CaseRun(current_case, gt_option, diagnosis_steps(self.dataset, current_case, self.config, budget), budget)
+        with routed_output(run.parts):
+            print(f"\n[No.{current_case['case_id']+1}]")
+            print('[QUESTION]\n', current_case['question'])
+        run.advance()
+        return run
+
+    def done(self, run):
+        # same (item, result, error) triple as scheduler.bounded_map
+        item = (run.current_case, run.gt_option)
+        if run.error is not None:
+            return item, None, run.error
+        with routed_output(run.parts):
+            record = self.finish(run.current_case, run.gt_option, run.result, time.time() - run.start, run.budget)
+            print('\n' + '=' * 130 + '\n')
+        transcript = ''.join(run.parts)
+        if self.verbosity >= 1:
+            record['transcript'] = transcript
+        if self.verbosity >= 2:
+            emit_case_output(transcript)
+        return item, record, None
+
+    def run(self, cases):
+        budget = self.config.budget
+        for window in windows(cases, self.window):
+            if budget is not None and budget.exhausted():
+                # the run budget is a hard stop for new cases, as in BudgetGovernor.admit
+                budget.stopped = True
+                return
+            runs = [self.start(current_case, gt_option) for current_case, gt_option in window]
+            for run in runs:
+                if run.step is None:
+                    yield self.done(run)
+            while True:
+                active = [run for run in runs if run.step is not None]
+                if not active:
+                    break
+                # always serve the earliest stage first, so later stages collect the largest batches
+                stage = min(STAGES.index(run.step.stage) for run in active)
+                group = [run for run in active if STAGES.index(run.step.stage) == stage]
+                if not self.execute(STAGES[stage], group):
+                    return
+                for run in group:
+                    if run.step is None:
+                        yield self.done(run)
+
+    def execute(self, stage, group):
+        jobs = [(run, k, call) for run in group for k, call in enumerate(run.step.calls)]
+        if self.batch_dir:
+            missing = self.write_batch(stage, jobs)
+            if self.batch_only and missing:
+                return False
+        print(f'[STAGE] {stage}: {len(jobs)} calls for {len(group)} cases')
+
+        def job(item):
+            run, k, call = item
+            with trace_context(case_id=run.current_case['case_id'], level=run.step.level, role=run.step.role):
+                return call.run()
+
+        replies = {id(run): [None] * len(run.step.calls) for run in group}
+        errors = {}
+        for (run, k, call), reply, error in bounded_map(job, jobs, self.concurrency):
+            if error is not None:
+                errors.setdefault(id(run), error)
+            else:
+                replies[id(run)][k] = reply
+        for run in group:
+            if id(run) in errors:
+                run.step = None
+                run.error = errors[id(run)]
+            else:
+                run.advance(replies[id(run)])
+        return True
+
+    def write_batch(self, stage, jobs):
+        # Returns how many requests of the stage are not in the response cache yet. In batch_only mode
+        # only those are written; otherwise the file records the whole stage.
+        cache = get_response_cache()
+        # numbered per stage run, not per file written, so a batch_only rerun reproduces the same names
+        self.batches += 1
+        lines = []
+        missing = 0
+        for run, k, call in jobs:
+            body = call.request_body()
+            cached = cache is not None and cache.contains(cache.request_key(body))
+            if not cached:
+                missing += 1
+            elif self.batch_only:
+                continue
+            custom_id = f"case{run.current_case['case_id']}-{stage}-{k}"
+            lines.append(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': BATCH_URL, 'body': body}, ensure_ascii=False))
+        if not lines:
+            return missing
+
+        path = Path(self.batch_dir) / f'{self.run_name}_{self.batches:03d}_{stage}.jsonl'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        print(f'[BATCH] {stage}: {len(lines)} requests written to {path}')
+        if self.batch_only and missing:
+            self.pending_batch = path
+        return missing
+
+def ingest_batch(requests_path, results_path, cache=None):
+    # Stores the replies of a finished batch in the response cache under the same keys as live requests,
+    # so the next stagewise run replays them. Returns (stored, failed).
+    cache = cache or get_response_cache()
+    if cache is None or cache.mode != 'rw':
+        raise ValueError('Ingesting batch results needs the response cache in rw mode')
+
+    bodies = {}
+    with open(requests_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                bodies[entry['custom_id']] = entry['body']
+
+    stored = failed = 0
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            body = bodies.get(entry.get('custom_id'))
+            response = entry.get('response') or {}
+            if body is None or entry.get('error') or response.get('status_code') != 200:
+                failed += 1
+                continue
+            reply = response['body']
+            contents = [choice['message'].get('content') or '' for choice in reply['choices']]
+            usage = reply.get('usage')
+            if usage:
+                usage = {k: usage[k] for k in ('prompt_tokens', 'completion_tokens', 'total_tokens')}
+            confidences = None
+            if body.get('logprobs'):
+                confidences = [answer_confidence(c, logprob_tokens(choice.get('logprobs'))) for c, choice in zip(contents, reply['choices'])]
+            cache.put(cache.request_key(body), body['model'], json.dumps(contents) if body.get('n', 1) > 1 else contents[0], usage, confidences)
+            stored += 1
+    return stored, failed
@@ -0,0 +1,128 @@
+import contextlib
+import contextvars
+import json
+import math
+import threading
+import time
+from pathlib import Path
+
+# Tags (case_id, level, role, ...) attached to every span recorded in the current context.
+# scheduler.fan_out copies the context into its workers, so tags follow calls across threads.
+_tags = contextvars.ContextVar('trace_tags', default={})
+
+@contextlib.contextmanager
+def trace_context(**tags):
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+def current_tags():
+    return dict(_tags.get())
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+class Tracer:
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.origin = time.time()
+
+    def record(self, name, start, end, **attrs):
+        span = {'name': name, 'start': start, 'duration': end - start, 'thread': threading.get_ident()}
+        span.update(current_tags())
+        span.update(attrs)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def take(self, case_id):
+        # removes and returns a case's spans, so a long-running service does not keep every trace
+        with self.lock:
+            taken = [span for span in self.spans if span.get('case_id') == case_id]
+            self.spans = [span for span in self.spans if span.get('case_id') != case_id]
+        return taken
+
+    def export_jsonl(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            spans = list(self.spans)
+        with open(path, 'w', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False) + '\n')
+
+    def export_chrome(self, path):
+        # Chrome trace event format, loadable in chrome://tracing and Perfetto; one process row per case.
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            label = f"L{span.get('level', '?')}/{span.get('role', span['name'])}"
+            events.append({
+                'name': label,
+                'cat': span['name'],
+                'ph': 'X',
+                'ts': (span['start'] - self.origin) * 1e6,
+                'dur': span['duration'] * 1e6,
+                'pid': span.get('case_id', 0),
+                'tid': span['thread'],
+                'args': {k: v for k, v in span.items() if k not in ('start', 'duration', 'thread')},
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        with self.lock:
+            spans = [span for span in self.spans if span['name'] == 'chat']
+        levels = {}
+        for span in spans:
+            levels.setdefault(span.get('level', '?'), []).append(span)
+        summary = {}
+        for level, group in sorted(levels.items(), key=lambda item: str(item[0])):
+            latencies = [span['duration'] for span in group]
+            ttfts = [span['ttft'] for span in group if span.get('ttft') is not None]
+            summary[level] = {
+                'calls': len(group),
+                'total_seconds': sum(latencies),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'queue_wait': sum(span.get('queue_wait', 0) for span in group),
+                'backoff': sum(span.get('backoff', 0) for span in group),
+                'ttft_p50': percentile(ttfts, 50) if ttfts else None,
+                'ttft_p95': percentile(ttfts, 95) if ttfts else None,
+                'stopped_early': sum(1 for span in group if span.get('stopped_early')),
+                'prompt_tokens': sum(span.get('prompt_tokens', 0) for span in group),
+                'completion_tokens': sum(span.get('completion_tokens', 0) for span in group),
+            }
+        return summary
+
+    def format_summary(self):
+        lines = ['Level | calls | total(s) | p50(s) | p95(s) | p99(s) | queue(s) | backoff(s) | prompt tok | completion tok']
+        summary = self.summary()
+        streamed = any(s['ttft_p50'] is not None for s in summary.values())
+        if streamed:
+            lines[0] += ' | ttft p50(s) | ttft p95(s) | early stops'
+        for level, s in summary.items():
+            line = f"{level} | {s['calls']} | {s['total_seconds']:.1f} | {s['p50']:.2f} | {s['p95']:.2f} | {s['p99']:.2f} | {s['queue_wait']:.1f} | {s['backoff']:.1f} | {s['prompt_tokens']} | {s['completion_tokens']}"
+            if streamed:
+                line += f" | {s['ttft_p50'] or 0:.2f} | {s['ttft_p95'] or 0:.2f} | {s['stopped_early']}"
+            lines.append(line)
+        return '\n'.join(lines)
+
+_tracer = None
+
+def configure_tracer(enabled=True):
+    global _tracer
+    _tracer = Tracer() if enabled else None
+    return _tracer
+
+def get_tracer():
+    return _tracer
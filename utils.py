@@ -1,12 +1,9 @@
 import os
-from openai import OpenAI
 import re
+from clients import get_client
 
 def check_api():
-    client = OpenAI(
-        base_url='YOUR_API', 
-        api_key='YOUR_KEY'
-        )
+    client = get_client()
     try:
         models = client.models.list()
         print("API Key Available! Models:", [model.id for model in models.data])
@@ -21,7 +18,7 @@ def extract_option(s):
 
 def count_token_usage(total, current):
     for k in total.keys():
-        total[k] += current[k]
+        total[k] += current.get(k, 0)
     
     return total
     